@@ -0,0 +1,51 @@
+"""Скорость форматирования сообщений: `get_message` против пакетного.
+
+Запуск: python benchmarks/bench_format.py --records 1000000
+"""
+import argparse
+import io
+import time
+
+from workloads import generate_packages
+
+import homework
+
+
+def timed(name, func, records):
+    """Замерить `func` и напечатать скорость в сообщениях в секунду."""
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f'{name:24} {elapsed:8.3f} s {records / elapsed:12,.0f} msg/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=1_000_000)
+    args = parser.parse_args()
+    messages = [
+        homework.read_package(*package).show_training_info()
+        for package in generate_packages(args.records)
+    ]
+    columns = list(zip(*(
+        (message.training_type, message.duration, message.distance,
+         message.speed, message.calories) for message in messages)))
+
+    expected = timed('get_message', lambda: ''.join(
+        message.get_message() + '\n' for message in messages), len(messages))
+
+    def write_messages():
+        output = io.StringIO()
+        homework.write_messages(messages, output)
+        return output.getvalue()
+
+    rendered = timed('write_messages', write_messages, len(messages))
+    by_columns = timed('render_columns',
+                       lambda: homework.render_columns(*columns),
+                       len(messages))
+    assert expected == rendered == by_columns, 'Вывод не совпадает'
+
+
+if __name__ == '__main__':
+    main()
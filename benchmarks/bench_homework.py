@@ -0,0 +1,143 @@
+"""Бенчмарки всех путей обработки пакетов.
+
+Запуск: python benchmarks/bench_homework.py --records 1000 100000 \
+    --mix SWM=1,RUN=2,WLK=1 --output results.json --baseline baseline.json
+
+Результаты пишутся в JSON; при указании `--baseline` случаи, ставшие
+медленнее базового прогона больше чем на `--tolerance`, печатаются,
+а скрипт завершается с кодом 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+from workloads import generate_packages, parse_mix
+
+import homework
+
+
+def best_time(func, repeat):
+    """Лучшее время из `repeat` запусков `func` в секундах."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main_loop(packages):
+    """Цикл из `__main__`: `read_package` и `main` для каждого пакета."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for package in packages:
+            homework.main(homework.read_package(*package))
+
+
+def cases(packages):
+    """Пары (имя случая, функция без аргументов, число записей)."""
+    trainings = [homework.read_package(*package) for package in packages]
+    infos = [training.show_training_info() for training in trainings]
+    yield 'read_package', lambda: [
+        homework.read_package(*package) for package in packages
+    ], len(packages)
+    for training_class in homework.WORKOUT_CLASSES.values():
+        group = [training for training in trainings
+                 if type(training) is training_class]
+        for method in ('get_distance', 'get_mean_speed',
+                       'get_spent_calories'):
+            name = f'{training_class.__name__}.{method}'
+            yield name, lambda group=group, method=method: [
+                getattr(training, method)() for training in group
+            ], len(group)
+    yield 'show_training_info', lambda: [
+        training.show_training_info() for training in trainings
+    ], len(trainings)
+    yield 'get_message', lambda: [
+        info.get_message() for info in infos
+    ], len(infos)
+    yield 'main', lambda: main_loop(packages), len(packages)
+    yield 'calculate_messages', lambda: homework.calculate_messages(
+        packages), len(packages)
+    yield 'render_messages', lambda: ''.join(
+        homework.render_messages(infos)), len(infos)
+
+
+def run(records, mix, repeat, seed):
+    """Прогнать все случаи для каждого размера нагрузки."""
+    results = {}
+    # Необязательный NumPy импортируется при первом пакетном расчете.
+    homework.calculate_messages(generate_packages(1))
+    for count in records:
+        packages = generate_packages(count, mix, seed)
+        for name, func, size in cases(packages):
+            if not size:
+                continue
+            seconds = best_time(func, repeat)
+            results[f'{name}[{count}]'] = {
+                'records': size,
+                'seconds': seconds,
+                'ns_per_record': seconds / size * 1e9,
+            }
+            print(f'{name:32} {count:>10} '
+                  f'{seconds / size * 1e9:12.1f} ns/record')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Случаи, ставшие медленнее базовых больше чем на `tolerance`."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['ns_per_record'] / base['ns_per_record']
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+',
+                        default=[1000, 100_000])
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help='доли видов, например SWM=1,RUN=2,WLK=1')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--baseline', help='JSON прошлого прогона')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = run(args.records, args.mix, args.repeat, args.seed)
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'records': args.records,
+            'mix': args.mix,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, ratio in regressions:
+            print(f'РЕГРЕССИЯ {name}: в {ratio:.2f} раза медленнее')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Сравнение памяти: объекты `Training` против `TrainingBatch`.
+
+Запуск: python benchmarks/bench_memory.py --records 100000
+"""
+import argparse
+import gc
+import tracemalloc
+
+from workloads import generate_packages
+
+import homework
+
+
+def measure(build):
+    """Память в байтах, занятая результатом `build()`."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=100_000)
+    args = parser.parse_args()
+    packages = generate_packages(args.records)
+
+    def objects():
+        return [homework.read_package(*package) for package in packages]
+
+    def messages():
+        return [homework.read_package(*package).show_training_info()
+                for package in packages]
+
+    def batch():
+        return homework.TrainingBatch(packages)
+
+    results = {name: measure(build) for name, build in (
+        ('Training objects', objects),
+        ('InfoMessage objects', messages),
+        ('TrainingBatch', batch),
+    )}
+    for name, size in results.items():
+        print(f'{name:20} {size / 2 ** 20:10.2f} MiB '
+              f'{size / args.records:8.1f} B/record')
+
+
+if __name__ == '__main__':
+    main()
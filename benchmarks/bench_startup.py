@@ -0,0 +1,60 @@
+"""Время запуска: импорт `homework` и короткий прогон примеров.
+
+Запуск: python benchmarks/bench_startup.py --budget-ms 6
+
+Время импорта берется из `python -X importtime` (накопленное время
+модуля `homework`, медиана по `--runs` запускам). Если медиана больше
+бюджета, скрипт завершается с кодом 1.
+"""
+import argparse
+import py_compile
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
+
+
+def import_time_us():
+    """Накопленное время импорта `homework` в микросекундах."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import homework'],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if name.strip() == 'homework':
+            return int(cumulative)
+    raise RuntimeError('В выводе -X importtime нет модуля homework')
+
+
+def demo_time_s():
+    """Время полного запуска `python -m homework` в секундах."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'homework'], cwd=BASE_DIR,
+                   capture_output=True, check=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=6.0)
+    args = parser.parse_args()
+    # Без .pyc в замер попала бы компиляция модуля.
+    py_compile.compile(str(BASE_DIR / 'homework.py'))
+    imports = [import_time_us() / 1000 for _ in range(args.runs)]
+    demos = [demo_time_s() * 1000 for _ in range(args.runs)]
+    import_ms = statistics.median(imports)
+    print(f'import homework      {import_ms:8.1f} ms (медиана)')
+    print(f'python -m homework   {statistics.median(demos):8.1f} ms '
+          f'(медиана, вместе с запуском интерпретатора)')
+    if import_ms > args.budget_ms:
+        print(f'Импорт дольше бюджета {args.budget_ms} ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Нагрузочный и длительный (soak) прогон обработки пакетов.
+
+Запуск: python benchmarks/soak.py --duration 600 --workers 4 \
+    --rate 20000 --max-p99-ms 1 --max-rss-growth-mb 20
+
+Каждый исполнитель (процесс или поток) генерирует пакеты SWM/RUN/WLK
+с правдоподобными значениями и проводит их через `read_package`,
+`show_training_info` и `get_message`. С `--rate` пакеты отправляются по
+расписанию, и задержка считается от запланированного момента, поэтому
+отставание от расписания попадает в задержку. Без `--rate` исполнители
+работают без пауз.
+
+По окончании печатаются пропускная способность по интервалам и в
+среднем, задержки p50/p99/p99.9, рост RSS после прогрева и паузы
+сборщика мусора. Если нарушен любой из порогов `--min-throughput`,
+`--max-p99-ms`, `--max-p999-ms`, `--max-rss-growth-mb`,
+`--max-gc-pause-ms`, либо обработка пакета упала, скрипт печатает
+нарушения и завершается с кодом 1.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from workloads import DEFAULT_MIX, make_data, parse_mix
+
+import homework
+
+# Задержки копятся в логарифмических корзинах шириной 1%: память не
+# растет с длиной прогона, ошибка перцентиля не больше 1%.
+BUCKET_BASE = 1.01
+
+
+def bucket(nanoseconds):
+    """Номер корзины гистограммы для задержки."""
+    return int(math.log(max(nanoseconds, 1), BUCKET_BASE))
+
+
+def percentile(histogram, fraction):
+    """Перцентиль задержки в миллисекундах по гистограмме корзин."""
+    rank = fraction * sum(histogram.values())
+    seen = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= rank:
+            return BUCKET_BASE ** (index + 1) / 1e6
+    return 0.0
+
+
+def rss_mb():
+    """Текущий размер резидентной памяти процесса в МБ."""
+    try:
+        with open('/proc/self/statm') as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # Вне Linux доступен только пик.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class GcPauses:
+    """Длительность пауз сборщика мусора через `gc.callbacks`.
+
+    `gc.callbacks` общий для процесса, поэтому сборщик ставится один раз
+    на процесс (`gc_pauses`) и делится между потоками-исполнителями.
+    Паузы учитываются, пока хотя бы один исполнитель ведет замер
+    (`active`), поэтому прогрев не попадает в итоги, а пауза во время
+    работы нескольких потоков считается один раз.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self._started = None
+
+    def __call__(self, phase, info):
+        if not self.active:
+            self._started = None
+        elif phase == 'start':
+            self._started = time.perf_counter()
+        elif self._started is not None:
+            pause = time.perf_counter() - self._started
+            self.count += 1
+            self.total += pause
+            self.longest = max(self.longest, pause)
+            self._started = None
+
+
+_GC_PAUSES = None
+_GC_LOCK = threading.Lock()
+
+
+def gc_pauses():
+    """Единственный на процесс `GcPauses`, подключенный к `gc.callbacks`."""
+    global _GC_PAUSES
+    with _GC_LOCK:
+        if _GC_PAUSES is None:
+            _GC_PAUSES = GcPauses()
+            gc.callbacks.append(_GC_PAUSES)
+    return _GC_PAUSES
+
+
+def soak_worker(worker, duration, rate, interval, warmup, mix, seed):
+    """Нагрузить обработку пакетов на `duration` секунд и вернуть замеры."""
+    rng = random.Random(seed + worker)
+    kinds = list(mix)
+    weights = list(mix.values())
+    histogram = Counter()
+    intervals = []
+    errors = 0
+    period = 1 / rate if rate else 0.0
+
+    # Прогрев: импорты, кэши и первые аллокации не считаются ростом RSS.
+    for _ in range(warmup):
+        workout_type = rng.choices(kinds, weights)[0]
+        homework.read_package(workout_type, make_data(workout_type, rng))
+    rss_start = rss_mb()
+    pauses = gc_pauses()
+    with _GC_LOCK:
+        pauses.active += 1
+    gc_start = (pauses.count, pauses.total)
+    started = time.perf_counter()
+    deadline = started + duration
+    next_report = started + interval
+    scheduled = started
+    done = 0
+    reported = 0
+    now = started
+    while now < deadline:
+        workout_type = rng.choices(kinds, weights)[0]
+        data = make_data(workout_type, rng)
+        if period:
+            scheduled += period
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            begin = scheduled
+        else:
+            begin = time.perf_counter()
+        try:
+            homework.read_package(workout_type, data).show_training_info(
+                ).get_message()
+        except Exception:
+            errors += 1
+        now = time.perf_counter()
+        histogram[bucket((now - begin) * 1e9)] += 1
+        done += 1
+        if now >= next_report:
+            intervals.append(done - reported)
+            reported = done
+            next_report += interval
+    elapsed = time.perf_counter() - started
+    with _GC_LOCK:
+        pauses.active -= 1
+    if done > reported:
+        intervals.append(done - reported)
+    return {
+        'packets': done,
+        'errors': errors,
+        'elapsed': elapsed,
+        'intervals': intervals,
+        'histogram': dict(histogram),
+        'rss_start_mb': rss_start,
+        'rss_end_mb': rss_mb(),
+        'gc_count': pauses.count - gc_start[0],
+        'gc_total_s': pauses.total - gc_start[1],
+        'gc_longest_s': pauses.longest,
+    }
+
+
+def run(args):
+    """Запустить исполнителей и собрать их замеры."""
+    executor_class = (ProcessPoolExecutor if args.mode == 'process'
+                      else ThreadPoolExecutor)
+    rate = args.rate / args.workers if args.rate else 0
+    pauses = gc_pauses()
+    gc_start = (pauses.count, pauses.total)
+    with executor_class(args.workers) as executor:
+        futures = [
+            executor.submit(soak_worker, worker, args.duration, rate,
+                            args.interval, args.warmup, args.mix, args.seed)
+            for worker in range(args.workers)
+        ]
+        results = [future.result() for future in futures]
+    if args.mode == 'thread':
+        # Потоки делят процесс и его паузы: каждая пауза попала в замеры
+        # всех потоков, работавших в этот момент. Берем итог процесса.
+        for result in results:
+            result['gc_count'] = result['gc_total_s'] = 0
+        results[0]['gc_count'] = pauses.count - gc_start[0]
+        results[0]['gc_total_s'] = pauses.total - gc_start[1]
+    return results
+
+
+def summarize(results, interval):
+    """Сводка замеров всех исполнителей."""
+    histogram = Counter()
+    for result in results:
+        histogram.update({int(index): count
+                          for index, count in result['histogram'].items()})
+    length = max(len(result['intervals']) for result in results)
+    throughput = [
+        sum(result['intervals'][index] for result in results
+            if index < len(result['intervals'])) / interval
+        for index in range(length)
+    ]
+    packets = sum(result['packets'] for result in results)
+    elapsed = max(result['elapsed'] for result in results)
+    # Для потоков RSS общий, поэтому рост берется по худшему исполнителю.
+    growth = max(result['rss_end_mb'] - result['rss_start_mb']
+                 for result in results)
+    return {
+        'packets': packets,
+        'errors': sum(result['errors'] for result in results),
+        'throughput': packets / elapsed,
+        # Последний интервал может быть неполным.
+        'min_interval_throughput': min(throughput[:-1] or throughput),
+        'interval_throughput': throughput,
+        'p50_ms': percentile(histogram, 0.5),
+        'p99_ms': percentile(histogram, 0.99),
+        'p999_ms': percentile(histogram, 0.999),
+        'rss_growth_mb': growth,
+        'gc_count': sum(result['gc_count'] for result in results),
+        'gc_total_ms': sum(result['gc_total_s'] for result in results) * 1e3,
+        'gc_longest_ms': max(result['gc_longest_s']
+                             for result in results) * 1e3,
+    }
+
+
+def violations(summary, args):
+    """Нарушенные пороги: строки для печати."""
+    checks = [
+        ('пропускная способность', summary['min_interval_throughput'],
+         args.min_throughput, False),
+        ('p99, ms', summary['p99_ms'], args.max_p99_ms, True),
+        ('p99.9, ms', summary['p999_ms'], args.max_p999_ms, True),
+        ('рост RSS, МБ', summary['rss_growth_mb'],
+         args.max_rss_growth_mb, True),
+        ('пауза GC, ms', summary['gc_longest_ms'], args.max_gc_pause_ms,
+         True),
+    ]
+    failed = [
+        f'{name}: {value:.3f}, порог {limit}'
+        for name, value, limit, is_maximum in checks
+        if limit is not None and (value > limit if is_maximum
+                                  else value < limit)
+    ]
+    if summary['errors']:
+        failed.append(f'ошибки обработки: {summary["errors"]}')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--duration', type=float, default=60,
+                        help='длительность прогона, с')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='целевой поток, пакетов/с на все исполнители '
+                             '(0 - без ограничения)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--mode', choices=('process', 'thread'),
+                        default='process')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='доли видов, например SWM=1,RUN=2,WLK=1')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interval', type=float, default=10,
+                        help='интервал замера пропускной способности, с')
+    parser.add_argument('--warmup', type=int, default=10000,
+                        help='пакетов прогрева на исполнителя')
+    parser.add_argument('--output', help='файл для сводки в JSON')
+    parser.add_argument('--min-throughput', type=float,
+                        help='минимум пакетов/с в любом полном интервале')
+    parser.add_argument('--max-p99-ms', type=float)
+    parser.add_argument('--max-p999-ms', type=float)
+    parser.add_argument('--max-rss-growth-mb', type=float)
+    parser.add_argument('--max-gc-pause-ms', type=float)
+    args = parser.parse_args()
+
+    summary = summarize(run(args), args.interval)
+    for index, value in enumerate(summary['interval_throughput']):
+        print(f'интервал {index:4} {value:14.0f} пакетов/с')
+    print(f'пакетов              {summary["packets"]:14}')
+    print(f'в среднем            {summary["throughput"]:14.0f} пакетов/с')
+    print(f'p50 / p99 / p99.9    {summary["p50_ms"]:.3f} / '
+          f'{summary["p99_ms"]:.3f} / {summary["p999_ms"]:.3f} ms')
+    print(f'рост RSS             {summary["rss_growth_mb"]:14.1f} МБ')
+    print(f'GC                   {summary["gc_count"]} пауз, всего '
+          f'{summary["gc_total_ms"]:.1f} ms, дольше всего '
+          f'{summary["gc_longest_ms"]:.3f} ms')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'args': vars(args), 'summary': summary}, file,
+                      indent=2, ensure_ascii=False)
+    failed = violations(summary, args)
+    for line in failed:
+        print(f'РЕГРЕССИЯ {line}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Синтетические пакеты датчиков для бенчмарков."""
+import random
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
+sys.path.append(str(BASE_DIR))
+
+DEFAULT_MIX = {'SWM': 1, 'RUN': 1, 'WLK': 1}
+
+
+def parse_mix(text):
+    """Разобрать долю видов тренировок вида `SWM=1,RUN=2,WLK=1`."""
+    mix = {}
+    for item in text.split(','):
+        workout_type, _, weight = item.partition('=')
+        mix[workout_type.strip()] = float(weight or 1)
+    return mix
+
+
+def generate_packages(count, mix=None, seed=0):
+    """Сгенерировать `count` пакетов в пропорциях `mix`."""
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    types = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [(workout_type, make_data(workout_type, rng))
+            for workout_type in types]
+
+
+def make_data(workout_type, rng):
+    """Данные одного пакета с правдоподобными значениями."""
+    duration = round(rng.uniform(0.25, 2.5), 3)
+    weight = round(rng.uniform(45, 110), 1)
+    if workout_type == 'SWM':
+        length_pool = rng.choice((25, 50))
+        count_pool = max(1, round(
+            rng.uniform(1.5, 4) * duration * 1000 / length_pool))
+        strokes = round(length_pool * count_pool / 1.38 * rng.uniform(0.8, 1.2))
+        return [strokes, duration, weight, length_pool, count_pool]
+    if workout_type == 'RUN':
+        return [round(rng.uniform(6, 14) * duration * 1000 / 0.65),
+                duration, weight]
+    return [round(rng.uniform(4, 7) * duration * 1000 / 0.65),
+            duration, weight, round(rng.uniform(150, 200))]
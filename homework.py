@@ -1,6 +1,180 @@
+from __future__ import annotations
+
+import math
+import os
+import sys
+import time
+from itertools import accumulate, islice
+from math import isfinite
+
+# Остальные модули, даже из стандартной библиотеки, импортируются в
+# функциях, которые их используют: `import homework` и короткие запуски
+# не платят за загрузку typing, re, collections и прочих. Аннотации не
+# вычисляются, поэтому имена для них нужны только при проверке типов.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import asyncio
+    import struct
+    from collections import deque
+    from typing import (Callable, Iterable, Iterator, Optional, Sequence,
+                        TextIO)
+
+
+USE_NUMPY = True
+
+
+def _numpy():
+    """Вернуть модуль numpy, если он установлен и разрешён."""
+    if not USE_NUMPY:
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class Metrics:
+    """Счетчики, таймеры и ошибки этапов обработки пакетов.
+
+    Этапы: `dispatch` (выбор класса в `read_package`), `construct`
+    (создание тренировки), `calculate` (`show_training_info`) и
+    `format` (`get_message`). Метка - имя класса тренировки, а для
+    ошибок выбора класса - код из пакета.
+
+    Пакетные пути (`calculate_packages`, `format_columns`,
+    `render_columns`) учитывают пачку одним вызовом на этап и вид
+    тренировки с числом пакетов `rows`; этапы проверки пачки и
+    форматирования помечены `batch`. Перцентили считаются по времени
+    на пакет в последних `window` замерах каждой пары этап-метка.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, window: int = 1000) -> None:
+        from collections import Counter
+
+        self.window = window
+        self.calls: Counter = Counter()
+        self.seconds: Counter = Counter()
+        self.rows: Counter = Counter()
+        self.samples: dict[tuple[str, str], deque] = {}
+        self.errors: Counter = Counter()
+
+    def measure(self, stage: str, label: str,
+                rows: int = 1) -> _Measurement:
+        """Замерить блок `with` как вызов этапа `stage` над `rows` пакетами."""
+        return _Measurement(self, stage, label, rows)
+
+    def record(self, stage: str, label: str, seconds: float,
+               rows: int = 1) -> None:
+        """Учесть один вызов этапа над `rows` пакетами."""
+        key = (stage, label)
+        self.calls[key] += 1
+        self.rows[key] += rows
+        self.seconds[key] += seconds
+        if key not in self.samples:
+            from collections import deque
+
+            self.samples[key] = deque(maxlen=self.window)
+        self.samples[key].append(seconds / rows if rows else seconds)
+
+    def to_dict(self) -> dict:
+        """Снимок показателей в виде словаря."""
+        stages: dict = {}
+        for (stage, label), calls in self.calls.items():
+            samples = sorted(self.samples[stage, label])
+            stages.setdefault(stage, {})[label] = {
+                'calls': calls,
+                'rows': self.rows[stage, label],
+                'seconds': self.seconds[stage, label],
+                **{f'p{round(share * 100)}': percentile(samples, share)
+                   for share in self.QUANTILES},
+            }
+        errors: dict = {}
+        for (stage, label, error), count in self.errors.items():
+            errors.setdefault(stage, {}).setdefault(label, {})[error] = count
+        return {'stages': stages, 'errors': errors}
+
+    def to_prometheus(self, prefix: str = 'homework') -> str:
+        """Снимок показателей в текстовом формате Prometheus."""
+        lines = [f'# TYPE {prefix}_stage_calls_total counter',
+                 f'# TYPE {prefix}_stage_rows_total counter',
+                 f'# TYPE {prefix}_stage_seconds_total counter',
+                 f'# TYPE {prefix}_stage_seconds summary']
+        for (stage, label), calls in sorted(self.calls.items()):
+            labels = f'stage="{stage}",workout="{label}"'
+            lines.append(f'{prefix}_stage_calls_total{{{labels}}} {calls}')
+            lines.append(f'{prefix}_stage_rows_total{{{labels}}} '
+                         f'{self.rows[stage, label]}')
+            lines.append(f'{prefix}_stage_seconds_total{{{labels}}} '
+                         f'{self.seconds[stage, label]!r}')
+            samples = sorted(self.samples[stage, label])
+            for share in self.QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{{labels},'
+                             f'quantile="{share}"}} '
+                             f'{percentile(samples, share)!r}')
+        lines.append(f'# TYPE {prefix}_errors_total counter')
+        for (stage, label, error), count in sorted(self.errors.items()):
+            lines.append(f'{prefix}_errors_total{{stage="{stage}",'
+                         f'workout="{label}",error="{error}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Measurement:
+    """Контекст `Metrics.measure`: время блока или тип его ошибки."""
+
+    __slots__ = ('metrics', 'stage', 'label', 'rows', 'started')
+
+    def __init__(self, metrics: Metrics, stage: str, label: str,
+                 rows: int) -> None:
+        self.metrics = metrics
+        self.stage = stage
+        self.label = label
+        self.rows = rows
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        if error_type is None:
+            self.metrics.record(self.stage, self.label,
+                                time.perf_counter() - self.started,
+                                self.rows)
+        elif issubclass(error_type, Exception):
+            self.metrics.errors[
+                self.stage, self.label, error_type.__name__] += 1
+
+
+METRICS: Optional[Metrics] = None
+
+
+def enable_metrics(metrics: Optional[Metrics] = None) -> Metrics:
+    """Включить сбор показателей и вернуть их хранилище."""
+    global METRICS
+    METRICS = metrics or Metrics()
+    return METRICS
+
+
+def disable_metrics() -> None:
+    """Выключить сбор показателей."""
+    global METRICS
+    METRICS = None
+
+
+def _measured(stage: str, label: str, rows: int, function, *args):
+    """Вызвать `function(*args)`, замерив его, если показатели включены."""
+    if METRICS is None:
+        return function(*args)
+    with METRICS.measure(stage, label, rows):
+        return function(*args)
+
+
 class InfoMessage:
     """Информационное сообщение о тренировке."""
 
+    __slots__ = ('training_type', 'duration', 'distance', 'speed', 'calories')
+
     MESSAGE_TRANING = ('Тип тренировки: {sport}; '
                        'Длительность: {time:.3f} ч.; '
                        'Дистанция: {dist:.3f} км; '
@@ -17,6 +191,13 @@ class InfoMessage:
 
     def get_message(self):
         """Возвращает строку информационного сообщения."""
+        if METRICS is not None:
+            with METRICS.measure('format', self.training_type):
+                return self._format()
+        return self._format()
+
+    def _format(self):
+        """Подставить поля в шаблон сообщения."""
         return self.MESSAGE_TRANING.format(
             sport=self.training_type,
             time=self.duration,
@@ -26,12 +207,214 @@ class InfoMessage:
         )
 
 
+def _compile_message(template: str) -> tuple[str, tuple[str, ...]]:
+    """Перевести шаблон `str.format` в %-шаблон и порядок его полей.
+
+    %-форматирование кортежа заметно быстрее `str.format` с именованными
+    аргументами, а спецификации вида `.3f` дают тот же текст.
+    """
+    from string import Formatter
+
+    parts = []
+    fields = []
+    for literal, field, spec, _ in Formatter().parse(template):
+        parts.append(literal.replace('%', '%%'))
+        if field is not None:
+            parts.append('%' + (spec or 's'))
+            fields.append(field)
+    return ''.join(parts), tuple(fields)
+
+
+# Поля шаблона сообщения и соответствующие им атрибуты `InfoMessage`.
+MESSAGE_ATTRIBUTES = {
+    'sport': 'training_type',
+    'time': 'duration',
+    'dist': 'distance',
+    'spe': 'speed',
+    'cal': 'calories',
+}
+# Результат `_compile_message(InfoMessage.MESSAGE_TRANING)`, записанный
+# заранее: разбор шаблона при импорте загрузил бы модули string и re.
+MESSAGE_FORMAT = ('Тип тренировки: %s; '
+                  'Длительность: %.3f ч.; '
+                  'Дистанция: %.3f км; '
+                  'Ср. скорость: %.3f км/ч; '
+                  'Потрачено ккал: %.3f.')
+MESSAGE_FIELDS = ('sport', 'time', 'dist', 'spe', 'cal')
+_MESSAGE_ORDER = [list(MESSAGE_ATTRIBUTES).index(field)
+                  for field in MESSAGE_FIELDS]
+
+
+def format_columns(names: Sequence[str], durations: Sequence[float],
+                   distances: Sequence[float], speeds: Sequence[float],
+                   calories: Sequence[float]) -> list[str]:
+    """Сообщения по столбцам полей `InfoMessage`, как `get_message`."""
+    columns = (names, durations, distances, speeds, calories)
+    return _measured('format', 'batch', len(names), _format_columns, columns)
+
+
+def _format_columns(columns: Sequence[Sequence]) -> list[str]:
+    """Сообщения `format_columns` без замера."""
+    return list(map(MESSAGE_FORMAT.__mod__,
+                    zip(*(columns[index] for index in _MESSAGE_ORDER))))
+
+
+def render_columns(names: Sequence[str], durations: Sequence[float],
+                   distances: Sequence[float], speeds: Sequence[float],
+                   calories: Sequence[float]) -> str:
+    """Текст сообщений по столбцам: по строке на запись.
+
+    Все записи форматируются одной операцией `%` над общим шаблоном,
+    без промежуточной строки на каждое сообщение.
+    """
+    columns = (names, durations, distances, speeds, calories)
+    return _measured('format', 'batch', len(names), _render_columns, columns)
+
+
+def _render_columns(columns: Sequence[Sequence]) -> str:
+    """Текст `render_columns` без замера."""
+    count = len(columns[0])
+    values = [None] * (count * len(_MESSAGE_ORDER))
+    for offset, index in enumerate(_MESSAGE_ORDER):
+        values[offset::len(_MESSAGE_ORDER)] = columns[index]
+    return ((MESSAGE_FORMAT + '\n') * count) % tuple(values)
+
+
+def render_messages(messages: Iterable[InfoMessage],
+                    chunk_size: int = 1024) -> Iterator[str]:
+    """Текст сообщений блоками по `chunk_size` строк."""
+    from operator import attrgetter
+
+    fields = attrgetter(*MESSAGE_ATTRIBUTES.values())
+    for chunk in iter_chunks(map(fields, messages), chunk_size):
+        yield render_columns(*zip(*chunk))
+
+
+def write_messages(messages: Iterable[InfoMessage], output: TextIO,
+                   chunk_size: int = 1024) -> None:
+    """Записать сообщения в поток блоками."""
+    for block in render_messages(messages, chunk_size):
+        output.write(block)
+
+
+def distance_kernel(action, len_step, m_in_km):
+    """Дистанция в км по числу шагов или гребков."""
+    return action * len_step / m_in_km
+
+
+def mean_speed_kernel(distance, duration):
+    """Средняя скорость в км/ч."""
+    return distance / duration
+
+
+def running_calories_kernel(speed, duration, weight, speed_multiplier,
+                            speed_shift, m_in_km, min_in_hour):
+    """Калории для бега."""
+    return ((speed_multiplier * speed + speed_shift)
+            * weight / m_in_km
+            * (duration * min_in_hour))
+
+
+def walking_calories_kernel(speed, duration, weight, height,
+                            weight_multiplier, speed_multiplier,
+                            kmh_in_msec, cm_in_m, min_in_hour):
+    """Калории для спортивной ходьбы."""
+    # Квадрат считаем умножением: pow() из libm и NumPy округляют
+    # по-разному, а пакетный расчет должен совпадать с поштучным.
+    speed_m_per_sec = speed * kmh_in_msec
+    return ((weight_multiplier * weight
+            + (speed_m_per_sec * speed_m_per_sec / (height / cm_in_m))
+             * speed_multiplier * weight)
+            * (duration * min_in_hour))
+
+
+def swimming_speed_kernel(length_pool, count_pool, duration, m_in_km):
+    """Средняя скорость плавания в км/ч по длине и числу бассейнов."""
+    return (length_pool * count_pool / m_in_km) / duration
+
+
+def swimming_calories_kernel(speed, duration, weight, speed_shift,
+                             speed_multiplier):
+    """Калории для плавания."""
+    return (speed + speed_shift) * speed_multiplier * weight * duration
+
+
+# Ядра формул - чистые функции от чисел или массивов одной длины.
+PYTHON_KERNELS = {
+    'distance': distance_kernel,
+    'mean_speed': mean_speed_kernel,
+    'running_calories': running_calories_kernel,
+    'walking_calories': walking_calories_kernel,
+    'swimming_speed': swimming_speed_kernel,
+    'swimming_calories': swimming_calories_kernel,
+}
+# `python` (по умолчанию) - ядра NumPy; `numba` - всегда Numba;
+# `auto` - Numba для больших пачек, если установлена. Numba включается
+# только явно: на 1M строк она быстрее NumPy лишь на 10-20%, а первая
+# большая пачка в каждом процессе платит за импорт и загрузку ядер
+# (около 0.8 с с кэшем компиляции, 2.5 с без него).
+KERNEL_BACKEND = os.environ.get('HOMEWORK_KERNELS', 'python')
+# Для `auto`: меньшие пачки не окупают импорт Numba.
+ACCELERATE_MIN_ROWS = 100_000
+
+
+def batch_kernels(rows: int) -> dict:
+    """Ядра для пакетного расчета `rows` строк массивами NumPy."""
+    if KERNEL_BACKEND == 'python' or (
+            KERNEL_BACKEND == 'auto' and rows < ACCELERATE_MIN_ROWS):
+        return PYTHON_KERNELS
+    kernels = _accelerated_kernels()
+    if kernels is None:
+        if KERNEL_BACKEND == 'numba':
+            raise ImportError('Для HOMEWORK_KERNELS=numba установите numba')
+        return PYTHON_KERNELS
+    return kernels
+
+
+# Ядра Numba по имени бэкенда; None, если Numba не установлена.
+_ACCELERATED_KERNELS: dict[str, Optional[dict]] = {}
+
+
+def _accelerated_kernels() -> Optional[dict]:
+    """Ядра, скомпилированные Numba, или None без нее.
+
+    Ядра собираются один раз на процесс, а скомпилированный код
+    кэшируется в `__pycache__`, поэтому следующие процессы и воркеры
+    пула не компилируют ядра заново.
+    """
+    if 'numba' not in _ACCELERATED_KERNELS:
+        try:
+            import numba
+        except ImportError:
+            kernels = None
+        else:
+            kernels = {name: numba.njit(kernel, cache=True)
+                       for name, kernel in PYTHON_KERNELS.items()}
+        _ACCELERATED_KERNELS['numba'] = kernels
+    return _ACCELERATED_KERNELS['numba']
+
+
+def _overrides(training_class: type, name: str) -> bool:
+    """Переопределен ли атрибут `name` у подкласса `Training`."""
+    mro = training_class.__mro__
+    return any(name in vars(base) for base in mro[:mro.index(Training)])
+
+
 class Training:
     """Базовый класс тренировки."""
 
     LEN_STEP = 0.65
     M_IN_KM = 1000
     MIN_IN_HOUR = 60
+    FIELDS = ('action', 'duration', 'weight')
+    # Формулы скорости и калорий заданы через `_mean_speed` и
+    # `_spent_calories`, а не переопределением `get_*` (см. `_calculate`).
+    _STANDARD_METHODS = True
+    # `calculate` считает массивы целиком; иначе он считает строки
+    # объектами класса (см. `__init_subclass__` и `register_workout`).
+    _VECTORISED = False
+    # Поля-счетчики, которые датчик присылает посекундно (`SampleSession`).
+    SAMPLED_FIELDS = ('action',)
 
     def __init__(self, action: int, duration: float, weight: float) -> None:
         self.action = action
@@ -40,24 +423,102 @@ class Training:
 
     def get_distance(self):
         """Получить дистанцию в км."""
-        return self.action * self.LEN_STEP / self.M_IN_KM
+        return distance_kernel(self.action, self.LEN_STEP, self.M_IN_KM)
 
     def get_mean_speed(self):
         """Получить среднюю скорость движения."""
-        distance = self.get_distance()
-        return distance / self.duration
+        return self._mean_speed(self.get_distance())
 
     def get_spent_calories(self):
         """Получить количество затраченных калорий."""
+        return self._spent_calories(self.get_mean_speed())
+
+    def _mean_speed(self, distance):
+        """Средняя скорость при уже посчитанной дистанции."""
+        return mean_speed_kernel(distance, self.duration)
+
+    def _spent_calories(self, speed):
+        """Калории при уже посчитанной скорости.
+
+        По умолчанию - `calculate_calories` от скорости и полей тренировки
+        после `weight` в порядке `FIELDS`.
+        """
+        return self.calculate_calories(
+            speed, self.duration, self.weight,
+            *(getattr(self, field) for field in self.FIELDS[3:]))
+
+    @classmethod
+    def calculate(cls, action, duration, weight, *extra, kernels=None):
+        """Рассчитать дистанцию, скорость и калории по данным тренировки.
+
+        Аргументы могут быть как числами, так и массивами NumPy одной длины.
+        `kernels` - набор ядер формул, по умолчанию `PYTHON_KERNELS`.
+        """
+        if not cls._VECTORISED:
+            return cls._calculate_objects(action, duration, weight, *extra)
+        kernels = kernels or PYTHON_KERNELS
+        distance = kernels['distance'](action, cls.LEN_STEP, cls.M_IN_KM)
+        speed = kernels['mean_speed'](distance, duration)
+        calories = cls.calculate_calories(speed, duration, weight, *extra,
+                                          kernels=kernels)
+        return distance, speed, calories
+
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, *extra,
+                           kernels=None):
+        """Формула расчета калорий по средней скорости."""
         raise NotImplementedError("Метод реализован в дочерних классах")
 
+    @classmethod
+    def _calculate_objects(cls, *columns):
+        """`calculate` через объекты класса для невекторных формул.
+
+        Числа считаются одним объектом, массивы NumPy - объектом на
+        строку. Строка, на которой формула выбросила `ArithmeticError`,
+        дает NaN, как деление на ноль в массивах.
+        """
+        if not hasattr(columns[0], '__len__'):
+            return cls(*columns)._calculate()
+        results = []
+        for row in zip(*columns):
+            try:
+                results.append(cls(*row)._calculate())
+            except ArithmeticError:
+                results.append((math.nan,) * 3)
+        np = _numpy()
+        return tuple(np.array(results, dtype=np.float64).reshape(-1, 3).T)
+
     def show_training_info(self):
         """Вернуть информационное сообщение о выполненной тренировке."""
-        return InfoMessage(self.__class__.__name__,
-                           self.duration,
-                           self.get_distance(),
-                           self.get_mean_speed(),
-                           self.get_spent_calories())
+        if METRICS is not None:
+            with METRICS.measure('calculate', type(self).__name__):
+                return InfoMessage(type(self).__name__, self.duration,
+                                   *self._calculate())
+        return InfoMessage(type(self).__name__, self.duration,
+                           *self._calculate())
+
+    def _calculate(self):
+        """Дистанция, скорость и калории, каждая величина - один раз.
+
+        Если `get_mean_speed` или `get_spent_calories` переопределены у
+        класса-наследника или подменены у экземпляра, используются они.
+        """
+        distance = self.get_distance()
+        if (self._STANDARD_METHODS and 'get_mean_speed' not in self.__dict__
+                and 'get_spent_calories' not in self.__dict__):
+            speed = self._mean_speed(distance)
+            return distance, speed, self._spent_calories(speed)
+        return distance, self.get_mean_speed(), self.get_spent_calories()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._STANDARD_METHODS = (
+            cls.get_mean_speed is Training.get_mean_speed
+            and cls.get_spent_calories is Training.get_spent_calories)
+        cls._VECTORISED = _overrides(cls, 'calculate') or (
+            cls._STANDARD_METHODS and _overrides(cls, 'calculate_calories')
+            and not _overrides(cls, 'get_distance')
+            and not _overrides(cls, '_mean_speed'))
 
 
 class Running(Training):
@@ -66,13 +527,17 @@ class Running(Training):
     CALORIES_MEAN_SPEED_MULTIPLIER = 18
     CALORIES_MEAN_SPEED_SHIFT = 1.79
 
-    def get_spent_calories(self):
+    def _spent_calories(self, speed):
         """Реализация расчета калорий для бега."""
-        return ((self.CALORIES_MEAN_SPEED_MULTIPLIER
-                * self.get_mean_speed()
-                + self.CALORIES_MEAN_SPEED_SHIFT)
-                * self.weight / self.M_IN_KM
-                * (self.duration * self.MIN_IN_HOUR))
+        return self.calculate_calories(speed, self.duration, self.weight)
+
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, kernels=None):
+        """Формула расчета калорий для бега."""
+        kernels = kernels or PYTHON_KERNELS
+        return kernels['running_calories'](
+            speed, duration, weight, cls.CALORIES_MEAN_SPEED_MULTIPLIER,
+            cls.CALORIES_MEAN_SPEED_SHIFT, cls.M_IN_KM, cls.MIN_IN_HOUR)
 
 
 class SportsWalking(Training):
@@ -82,21 +547,27 @@ class SportsWalking(Training):
     CALORIES_WEIGHT_MULTIPLIER = 0.035
     KM_PER_HOUR_TO_M_PER_SEC = 0.278    # Добавляем константу для секунд в часе
     CENTIMETERS_IN_METER = 100
+    FIELDS = ('action', 'duration', 'weight', 'height')
 
     def __init__(self, action: int, duration: float, weight: float,
                  height: float) -> None:
         super().__init__(action, duration, weight)
         self.height = height
 
-    def get_spent_calories(self):
+    def _spent_calories(self, speed):
         """Реализация расчета калорий для спортивной ходьбы."""
+        return self.calculate_calories(speed, self.duration, self.weight,
+                                       self.height)
 
-        return ((self.CALORIES_WEIGHT_MULTIPLIER * self.weight
-                + ((self.get_mean_speed() * self.KM_PER_HOUR_TO_M_PER_SEC)
-                 ** 2
-                 / (self.height / self.CENTIMETERS_IN_METER))
-                 * self.CALORIES_SPEED_MULTIPLIER * self.weight)
-                * (self.duration * self.MIN_IN_HOUR))
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, height,
+                           kernels=None):
+        """Формула расчета калорий для спортивной ходьбы."""
+        kernels = kernels or PYTHON_KERNELS
+        return kernels['walking_calories'](
+            speed, duration, weight, height, cls.CALORIES_WEIGHT_MULTIPLIER,
+            cls.CALORIES_SPEED_MULTIPLIER, cls.KM_PER_HOUR_TO_M_PER_SEC,
+            cls.CENTIMETERS_IN_METER, cls.MIN_IN_HOUR)
 
 
 class Swimming(Training):
@@ -105,6 +576,8 @@ class Swimming(Training):
     LEN_STEP = 1.38  # Длина гребка в метрах
     CALORIES_MEAN_SPEED_SHIFT = 1.1
     CALORIES_MEAN_SPEED_MULTIPLIER = 2
+    FIELDS = ('action', 'duration', 'weight', 'length_pool', 'count_pool')
+    SAMPLED_FIELDS = ('action', 'count_pool')
 
     def __init__(self, action: int, duration: float, weight: float,
                  length_pool: float, count_pool: int) -> None:
@@ -112,16 +585,34 @@ class Swimming(Training):
         self.length_pool = length_pool
         self.count_pool = count_pool
 
-    def get_mean_speed(self):
+    def _mean_speed(self, distance):
         """Реализация расчета средней скорости для плавания."""
-        return ((self.length_pool * self.count_pool / self.M_IN_KM)
-                / self.duration)
+        return swimming_speed_kernel(self.length_pool, self.count_pool,
+                                     self.duration, self.M_IN_KM)
 
-    def get_spent_calories(self):
+    def _spent_calories(self, speed):
         """Реализация расчета калорий для плавания."""
-        return ((self.get_mean_speed() + self.CALORIES_MEAN_SPEED_SHIFT)
-                * self.CALORIES_MEAN_SPEED_MULTIPLIER
-                * self.weight * self.duration)
+        return self.calculate_calories(speed, self.duration, self.weight)
+
+    @classmethod
+    def calculate(cls, action, duration, weight, length_pool, count_pool,
+                  kernels=None):
+        """Рассчитать дистанцию, скорость и калории для плавания."""
+        kernels = kernels or PYTHON_KERNELS
+        distance = kernels['distance'](action, cls.LEN_STEP, cls.M_IN_KM)
+        speed = kernels['swimming_speed'](length_pool, count_pool, duration,
+                                          cls.M_IN_KM)
+        calories = cls.calculate_calories(speed, duration, weight,
+                                          kernels=kernels)
+        return distance, speed, calories
+
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, kernels=None):
+        """Формула расчета калорий для плавания."""
+        kernels = kernels or PYTHON_KERNELS
+        return kernels['swimming_calories'](
+            speed, duration, weight, cls.CALORIES_MEAN_SPEED_SHIFT,
+            cls.CALORIES_MEAN_SPEED_MULTIPLIER)
 
 
 WORKOUT_CLASSES: dict[str, type[Training]] = {
@@ -130,26 +621,2660 @@ WORKOUT_CLASSES: dict[str, type[Training]] = {
     'WLK': SportsWalking,
 }
 
+# Встроенные виды: плагины из entry points не могут их заменить.
+BUILTIN_WORKOUTS = frozenset(WORKOUT_CLASSES)
+
+
+class TrainingBatch:
+    """Компактное хранилище множества тренировок в виде столбцов.
+
+    Вид тренировки хранится байтом-индексом, поля пакетов - в массивах
+    `array('d')` в порядке данных `read_package`. Элементы доступны как
+    легковесные `TrainingView` с интерфейсом `Training`.
+    """
+
+    def __init__(self,
+                 packages: Iterable[tuple[str, Sequence[float]]] = ()
+                 ) -> None:
+        self.codes: list[str] = []
+        from array import array
+
+        self._code_index: dict[str, int] = {}
+        self.types = array('B')
+        width = max(len(cls.FIELDS) for cls in WORKOUT_CLASSES.values())
+        self.columns = tuple(array('d') for _ in range(width))
+        self.extend(packages)
+
+    def append(self, workout_type: str, data: Sequence[float]) -> None:
+        """Добавить пакет в хранилище."""
+        arity = len(WORKOUT_CLASSES[workout_type].FIELDS)
+        if len(data) != arity:
+            raise TypeError(f'Пакет {workout_type} должен содержать '
+                            f'{arity} полей, получено {len(data)}')
+        if workout_type not in self._code_index:
+            self._code_index[workout_type] = len(self.codes)
+            self.codes.append(workout_type)
+        self.types.append(self._code_index[workout_type])
+        for index, column in enumerate(self.columns):
+            column.append(data[index] if index < arity else 0.0)
+
+    def extend(self, packages: Iterable[tuple[str, Sequence[float]]]
+               ) -> None:
+        """Добавить несколько пакетов."""
+        for workout_type, data in packages:
+            self.append(workout_type, data)
+
+    def workout_type(self, index: int) -> str:
+        """Код вида тренировки для записи с номером `index`."""
+        return self.codes[self.types[index]]
+
+    def calculate(self):
+        """Рассчитать дистанцию, скорость и калории для всех записей."""
+        types = [self.codes[code] for code in self.types]
+        return calculate_batch(types, *self.columns)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> 'TrainingView':
+        if not -len(self) <= index < len(self):
+            raise IndexError('Индекс записи вне диапазона')
+        return TrainingView(self, index % len(self))
+
+    def __iter__(self) -> Iterator['TrainingView']:
+        for index in range(len(self)):
+            yield TrainingView(self, index)
+
+
+class TrainingView:
+    """Тренировка, данные которой лежат в `TrainingBatch`."""
+
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch: TrainingBatch, index: int) -> None:
+        self.batch = batch
+        self.index = index
+
+    @property
+    def training_class(self) -> type[Training]:
+        """Класс вида тренировки записи."""
+        return WORKOUT_CLASSES[self.batch.workout_type(self.index)]
+
+    def __getattr__(self, name: str) -> float:
+        fields = self.training_class.FIELDS
+        if name not in fields:
+            raise AttributeError(name)
+        return self.batch.columns[fields.index(name)][self.index]
+
+    def _calculate(self) -> tuple[float, float, float]:
+        """Рассчитать показатели записи формулами её класса."""
+        training_class = self.training_class
+        arity = len(training_class.FIELDS)
+        return training_class.calculate(
+            *(column[self.index] for column in self.batch.columns[:arity]))
+
+    def get_distance(self) -> float:
+        """Получить дистанцию в км."""
+        return self._calculate()[0]
+
+    def get_mean_speed(self) -> float:
+        """Получить среднюю скорость движения."""
+        return self._calculate()[1]
+
+    def get_spent_calories(self) -> float:
+        """Получить количество затраченных калорий."""
+        return self._calculate()[2]
+
+    def show_training_info(self) -> InfoMessage:
+        """Вернуть информационное сообщение о выполненной тренировке."""
+        return InfoMessage(self.training_class.__name__, self.duration,
+                           *self._calculate())
+
+
+class PacketError(ValueError):
+    """Пакет датчиков не удалось разобрать."""
+
+
+class UnknownWorkoutError(PacketError, KeyError):
+    """В пакете неизвестный код вида тренировки."""
+
+
+class PacketArityError(PacketError, TypeError):
+    """Число полей пакета не совпадает с видом тренировки."""
+
+
+class PacketDecoder:
+    """Проверка и создание тренировки одного вида.
+
+    Число полей и их имена берутся из `FIELDS` класса один раз при
+    создании декодера; пакет проверяется до вызова конструктора, чтобы
+    ошибка называла вид тренировки и поля, а не падала внутри `__init__`.
+    Сам вызов - замыкание `decode` без поиска атрибутов на каждый пакет;
+    `rebind` заново инициализирует уже созданную тренировку этого вида, а
+    `check` только проверяет пакет. Проверка у всех трех общая.
+    """
+
+    __slots__ = ('code', 'training_class', 'arity', 'fields', 'decode',
+                 'rebind', 'check')
+
+    def __init__(self, code: str, training_class: type[Training]) -> None:
+        self.code = code
+        self.training_class = training_class
+        self.fields = training_class.FIELDS
+        self.arity = len(self.fields)
+        self.check, self.decode, self.rebind = self._compile()
+
+    def _compile(self):
+        """Собрать функции проверки и создания тренировки."""
+        arity = self.arity
+        training_class = self.training_class
+        fail = self._fail
+
+        def check(data: Sequence[float]) -> None:
+            try:
+                valid = len(data) == arity and all(map(isfinite, data))
+            except TypeError:
+                valid = False
+            if not valid:
+                fail(data)
+
+        def decode(data: Sequence[float]) -> Training:
+            check(data)
+            return training_class(*data)
+
+        def rebind(training: Training, data: Sequence[float]) -> Training:
+            check(data)
+            training.__init__(*data)
+            return training
+        return check, decode, rebind
+
+    def __call__(self, data: Sequence[float]) -> Training:
+        return self.decode(data)
+
+    def _fail(self, data: Sequence[float]) -> None:
+        """Выбросить ошибку, объясняющую, чем плох пакет."""
+        if len(data) != self.arity:
+            raise PacketArityError(
+                f'Пакет {self.code} должен содержать {self.arity} полей '
+                f'({", ".join(self.fields)}), получено {len(data)}')
+        raise PacketError(
+            f'Поля пакета {self.code} ({", ".join(self.fields)}) '
+            f'должны быть конечными числами, получено {list(data)!r}')
+
+
+DECODERS: dict[str, PacketDecoder] = {}
+
+
+def rebuild_decoders() -> None:
+    """Пересобрать декодеры по текущему `WORKOUT_CLASSES`."""
+    DECODERS.clear()
+    DECODERS.update((code, PacketDecoder(code, training_class))
+                    for code, training_class in WORKOUT_CLASSES.items())
+
+
+def get_decoder(workout_type: str) -> PacketDecoder:
+    """Декодер для кода вида тренировки."""
+    decoder = DECODERS.get(workout_type)
+    if decoder is None:
+        if workout_type not in WORKOUT_CLASSES:
+            raise UnknownWorkoutError(
+                f'Неизвестный вид тренировки {workout_type!r}')
+        rebuild_decoders()
+        decoder = DECODERS[workout_type]
+    return decoder
+
+
+rebuild_decoders()
+
+
+def register_workout(code: str,
+                     training_class: Optional[type[Training]] = None,
+                     *, replace: bool = False):
+    """Зарегистрировать вид тренировки под кодом пакета.
+
+    Можно вызывать напрямую или как декоратор класса::
+
+        @register_workout('CYC')
+        class Cycling(Training):
+            FIELDS = ('action', 'duration', 'weight', 'cadence')
+            ...
+
+    Правила для класса, которые проверяются при регистрации:
+
+    - код - от 1 до 4 символов ASCII, класс - подкласс `Training`;
+    - `FIELDS` начинается с полей `Training`, всего полей не больше
+      `PACKET_FIELDS`; остальные поля передаются в `__init__` и
+      формулы в том же порядке;
+    - формула калорий - classmethod `calculate_calories(speed,
+      duration, weight, *поля после weight, kernels=None)`, собранная
+      из арифметики и ядер `kernels`, чтобы считать и числа, и массивы
+      NumPy; если класс переопределяет `calculate`, то же требуется от
+      `calculate(*FIELDS, kernels=None)`, и он обязан считать массивы.
+
+    Класс, который переопределяет `get_distance`, `get_mean_speed`,
+    `get_spent_calories` или `_mean_speed` без `calculate`, либо чья
+    `calculate_calories` не считает массивы, пакетные движки считают
+    построчно через объекты класса: результат совпадает с
+    `show_training_info`, но без выигрыша векторного расчета.
+
+    Декодеры пересобираются сразу, поэтому выбор вида при чтении
+    пакета - один поиск в словаре при любом числе плагинов.
+    """
+    if training_class is None:
+        return lambda cls: register_workout(code, cls, replace=replace)
+    _check_workout(code, training_class)
+    if code in WORKOUT_CLASSES and not replace:
+        raise ValueError(f'Вид тренировки {code!r} уже зарегистрирован: '
+                         f'{WORKOUT_CLASSES[code].__name__}')
+    WORKOUT_CLASSES[code] = training_class
+    rebuild_decoders()
+    return training_class
+
+
+def unregister_workout(code: str) -> type[Training]:
+    """Удалить вид тренировки из реестра и вернуть его класс."""
+    training_class = WORKOUT_CLASSES.pop(code)
+    rebuild_decoders()
+    return training_class
+
+
+def _check_workout(code: str, training_class: type[Training]) -> None:
+    """Проверить, что класс можно считать всеми движками."""
+    if not (isinstance(training_class, type)
+            and issubclass(training_class, Training)):
+        raise TypeError(f'{training_class!r} не является подклассом '
+                        f'Training')
+    if not (code.isascii() and 0 < len(code.encode()) <= 4):
+        raise ValueError(f'Код вида тренировки {code!r} должен состоять '
+                         f'из 1-4 символов ASCII')
+    fields = tuple(training_class.FIELDS)
+    if fields[:len(Training.FIELDS)] != Training.FIELDS:
+        raise ValueError(f'FIELDS класса {training_class.__name__} должны '
+                         f'начинаться с {Training.FIELDS}')
+    if len(fields) > PACKET_FIELDS:
+        raise ValueError(f'У {training_class.__name__} больше '
+                         f'{PACKET_FIELDS} полей')
+    _check_formulas(training_class)
+
+
+def _check_formulas(training_class: type[Training]) -> None:
+    """Проверить формулы, которые вызывают пакетные движки.
+
+    Формула, которая не принимает поля класса и `kernels`, - ошибка
+    регистрации. `calculate_calories`, которая падает на массивах или
+    возвращает не массив, переводит класс на построчный расчет.
+    """
+    from inspect import signature
+
+    name = training_class.__name__
+    fields = tuple(training_class.FIELDS)
+    if _overrides(training_class, 'calculate'):
+        method, arguments = training_class.calculate, fields
+    elif not any(_overrides(training_class, method) for method in (
+            'calculate_calories', 'get_spent_calories', '_spent_calories')):
+        raise TypeError(f'У {name} нет формулы калорий: переопределите '
+                        f'calculate_calories')
+    elif not training_class._VECTORISED:
+        return
+    else:
+        method = training_class.calculate_calories
+        arguments = ('speed',) + fields[1:]
+    try:
+        signature(method).bind(*arguments, kernels=None)
+    except TypeError:
+        raise TypeError(f'{name}.{method.__name__} должен принимать '
+                        f'({", ".join(arguments)}, kernels=None)') from None
+    if _accepts_arrays(method, len(arguments)):
+        return
+    if method.__name__ == 'calculate':
+        raise TypeError(f'{name}.calculate должен считать массивы NumPy')
+    training_class._VECTORISED = False
+
+
+def _accepts_arrays(method: Callable, arity: int) -> bool:
+    """Считает ли формула массивы NumPy поэлементно.
+
+    Без NumPy пакетные движки передают формулам только числа.
+    """
+    np = _numpy()
+    if np is None:
+        return True
+    rows = 2
+    try:
+        with np.errstate(all='ignore'):
+            values = method(*(np.ones(rows) for _ in range(arity)),
+                            kernels=PYTHON_KERNELS)
+    except Exception:
+        return False
+    if method.__name__ != 'calculate':
+        values = (values,)
+    return all(np.shape(value) == (rows,) for value in values)
+
+
+WORKOUT_ENTRY_POINTS = 'homework.workouts'
+
+
+def load_workout_plugins(group: str = WORKOUT_ENTRY_POINTS
+                         ) -> list[str]:
+    """Зарегистрировать виды тренировок из entry points пакетов.
+
+    Имя точки входа - код пакета, значение - подкласс `Training`,
+    например `CYC = cycling_plugin:Cycling`. Повторная загрузка
+    заменяет виды плагинов, но встроенные `BUILTIN_WORKOUTS` плагин
+    подменить не может: для их кодов выбрасывается `ValueError`.
+    Возвращает загруженные коды.
+    """
+    from importlib.metadata import entry_points
+    codes = []
+    for entry_point in entry_points(group=group):
+        if entry_point.name in BUILTIN_WORKOUTS:
+            raise ValueError(f'Плагин {entry_point.value!r} не может '
+                             f'заменить встроенный вид '
+                             f'{entry_point.name!r}')
+        register_workout(entry_point.name, entry_point.load(), replace=True)
+        codes.append(entry_point.name)
+    return codes
+
 
 def read_package(workout_type: str, data: list[int]) -> Training:
     """Прочитать данные полученные от датчиков."""
-    return WORKOUT_CLASSES[workout_type](*data)
+    if METRICS is not None:
+        return _read_package_measured(METRICS, workout_type, data)
+    decoder = DECODERS.get(workout_type) or get_decoder(workout_type)
+    return decoder.decode(data)
 
 
-def main(training: Training) -> None:
-    """Главная функция."""
-
-    info = training.show_training_info()
-    print(info.get_message())
+def _read_package_measured(metrics: 'Metrics', workout_type: str,
+                           data: list[int]) -> Training:
+    """`read_package` с замером выбора класса и создания объекта."""
+    with metrics.measure('dispatch', workout_type):
+        decoder = get_decoder(workout_type)
+    with metrics.measure('construct', decoder.training_class.__name__):
+        return decoder(data)
 
 
-if __name__ == '__main__':
-    packages = [
-        ('SWM', [720, 1, 80, 25, 40]),
-        ('RUN', [15000, 1, 75]),
-        ('WLK', [9000, 1, 75, 180]),
-    ]
+def read_packages(packages: Iterable[tuple[str, Sequence[float]]]
+                  ) -> dict[str, list[Training]]:
+    """Прочитать пакеты, сгруппировав тренировки по коду вида.
 
+    Декодер выбирается один раз на группу; группы идут в порядке первого
+    появления кода, тренировки внутри группы - в порядке пакетов.
+    """
+    groups: dict[str, list[Sequence[float]]] = {}
     for workout_type, data in packages:
-        training = read_package(workout_type, data)
-        main(training)
+        groups.setdefault(workout_type, []).append(data)
+    result = {}
+    for workout_type, group in groups.items():
+        decode = get_decoder(workout_type).decode
+        result[workout_type] = [decode(data) for data in group]
+    return result
+
+
+class TrainingCursor:
+    """Построчная обработка пакетов без новых объектов на каждый пакет.
+
+    На каждый вид тренировки создается один экземпляр, который для
+    следующего пакета заново инициализируется его полями; результаты
+    пишутся в один и тот же `InfoMessage`. Между пакетами остаются
+    только эти объекты, на пакет выделяется лишь строка сообщения.
+    Возвращенные `Training` и `InfoMessage` действительны до следующего
+    вызова: если их нужно сохранить, используйте `read_package`.
+    """
+
+    def __init__(self) -> None:
+        self._trainings: dict[str, tuple[PacketDecoder, Training]] = {}
+        self.info = InfoMessage('', 0.0, 0.0, 0.0, 0.0)
+
+    def load(self, workout_type: str, data: Sequence[float]) -> Training:
+        """Тренировка вида `workout_type` с полями пакета `data`."""
+        decoder, training = self._trainings.get(workout_type, (None, None))
+        if decoder is None or DECODERS.get(workout_type) is not decoder:
+            # Первый пакет вида или реестр видов пересобран.
+            decoder = get_decoder(workout_type)
+            training = decoder.decode(data)
+            self._trainings[workout_type] = decoder, training
+            return training
+        return decoder.rebind(training, data)
+
+    def show_training_info(self, workout_type: str,
+                           data: Sequence[float]) -> InfoMessage:
+        """Рассчитать пакет и вернуть общий `InfoMessage` курсора."""
+        training = self.load(workout_type, data)
+        info = self.info
+        info.training_type = type(training).__name__
+        info.duration = training.duration
+        info.distance, info.speed, info.calories = training._calculate()
+        return info
+
+    def get_message(self, workout_type: str, data: Sequence[float]) -> str:
+        """Сообщение `get_message` для пакета."""
+        return self.show_training_info(workout_type, data).get_message()
+
+
+def calculate_batch(workout_types: Sequence[str], action, duration, weight,
+                    *extra, precision: str = 'float64'):
+    """Рассчитать дистанцию, скорость и калории для массива тренировок.
+
+    Столбцы идут в том же порядке, что и данные пакета в `read_package`:
+    за `action`, `duration` и `weight` следуют поля вида тренировки
+    (`height` для ходьбы, `length_pool` и `count_pool` для плавания).
+    Значения в строках, которым поле не нужно, игнорируются.
+    Возвращает три столбца: дистанцию, скорость и калории в точности
+    `precision` (см. `PRECISIONS`).
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Неизвестная точность {precision!r}')
+    result = _calculate_columns(workout_types,
+                                (action, duration, weight) + extra)
+    if precision == 'float64':
+        return result
+    return tuple(quantize(column, precision) for column in result)
+
+
+def _calculate_columns(workout_types: Sequence[str],
+                       columns: Sequence[Sequence[float]]):
+    """Расчет `calculate_batch` в float64."""
+    from functools import partial
+
+    np = _numpy()
+    if np is None:
+        return _calculate_rows(workout_types, columns)
+    types = np.asarray(workout_types)
+    columns = [np.asarray(column, dtype=np.float64) for column in columns]
+    result = tuple(np.empty(len(types)) for _ in range(3))
+    kernels = batch_kernels(len(types))
+    codes = _present_codes(np, types)
+    for workout_type in codes:
+        training_class = WORKOUT_CLASSES[workout_type]
+        mask = types == workout_type
+        arity = len(training_class.FIELDS)
+        values = _measured(
+            'calculate', training_class.__name__, int(np.count_nonzero(mask)),
+            partial(training_class.calculate, kernels=kernels),
+            *(column[mask] for column in columns[:arity]))
+        for column, value in zip(result, values):
+            column[mask] = value
+    return result
+
+
+def _present_codes(np, types) -> list[str]:
+    """Коды видов, встреченные в массиве `types`.
+
+    Пакетные пути обходят только их, а не весь реестр, поэтому число
+    проходов по массиву не растет с числом зарегистрированных плагинов.
+    Для неизвестного кода выбрасывается `KeyError` с первым таким
+    кодом в порядке строк.
+    """
+    codes = np.unique(types).tolist()
+    unknown = [code for code in codes if code not in WORKOUT_CLASSES]
+    if unknown:
+        raise KeyError(types[np.isin(types, unknown)][0].item())
+    return codes
+
+
+# Точность хранения результатов пакетного расчета. Расчет всегда идет
+# в float64, округляется только сохраненный результат.
+#
+# fixed: целые тысячные в int32, округленные так же, как `:.3f`, -
+#   вдвое меньше памяти, чем float64. Ошибка не больше 0.0005, и
+#   сообщения совпадают с `get_message` побайтно для всех значений до
+#   `FIXED_MAX` по модулю; большие и нечисловые значения не помещаются
+#   в int32, и `quantize` выбрасывает `OverflowError`.
+#
+# float32 не предлагается: его 24 бит мантиссы не хватает на три знака
+# после запятой у больших значений, и текст сообщений менялся бы.
+PRECISIONS = ('float64', 'fixed')
+FIXED_SCALE = 1000
+FIXED_MAX = (2 ** 31 - 1) / FIXED_SCALE
+
+
+def quantize(column, precision: str):
+    """Сохранить столбец float64 в точности `precision`.
+
+    Для `fixed` значение по модулю больше `FIXED_MAX`, бесконечность или
+    NaN дают `OverflowError`, а не молча искаженный результат.
+    """
+    if precision == 'float64':
+        return column
+    np = _numpy()
+    if np is None:
+        from array import array
+
+        for value in column:
+            if not abs(value) <= FIXED_MAX:
+                raise _fixed_overflow(value)
+        return array('i', map(_to_fixed, column))
+    values = np.asarray(column, dtype=np.float64)
+    outside = ~(np.abs(values) <= FIXED_MAX)
+    if outside.any():
+        raise _fixed_overflow(values[outside][0].item())
+    scaled = values * FIXED_SCALE
+    fixed = np.rint(scaled)
+    # Умножение может сдвинуть значение через границу округления
+    # только вблизи половины тысячной; такие строки считаем точно.
+    near_tie = (np.abs(scaled - np.floor(scaled) - 0.5)
+                <= 4 * np.spacing(scaled))
+    for row in np.flatnonzero(near_tie):
+        fixed[row] = _to_fixed(values[row].item())
+    return fixed.astype(np.int32)
+
+
+def _fixed_overflow(value: float) -> OverflowError:
+    """Ошибка значения, не помещающегося в `fixed`."""
+    return OverflowError(f'Значение {value!r} не помещается в точность '
+                         f'fixed: допустимо по модулю до {FIXED_MAX}')
+
+
+def _to_fixed(value: float) -> int:
+    """Тысячные доли числа с тем же округлением, что у `:.3f`."""
+    return round(round(value, 3) * FIXED_SCALE)
+
+
+def dequantize(column, precision: str) -> list[float]:
+    """Столбец результатов обратно в список float для вывода."""
+    if precision == 'fixed':
+        return [value / FIXED_SCALE for value in column.tolist()]
+    return column.tolist()
+
+
+def _calculate_rows(workout_types: Sequence[str],
+                    columns: Sequence[Sequence[float]]):
+    """Построчный расчет `calculate_batch`, если NumPy недоступен."""
+    from array import array
+
+    groups: dict[str, list[int]] = {}
+    for index, workout_type in enumerate(workout_types):
+        groups.setdefault(workout_type, []).append(index)
+    result = tuple(array('d', bytes(8 * len(workout_types)))
+                   for _ in range(3))
+    for workout_type, rows in groups.items():
+        training_class = WORKOUT_CLASSES[workout_type]
+        _measured('calculate', training_class.__name__, len(rows),
+                  _calculate_class_rows, training_class, columns, rows,
+                  result)
+    return result
+
+
+def _calculate_class_rows(training_class: type[Training],
+                          columns: Sequence[Sequence[float]],
+                          rows: Sequence[int], result: tuple) -> None:
+    """Рассчитать строки `rows` одного вида и записать их в `result`."""
+    calculate = training_class.calculate
+    columns = columns[:len(training_class.FIELDS)]
+    distance, speed, calories = result
+    for index in rows:
+        distance[index], speed[index], calories[index] = calculate(
+            *(column[index] for column in columns))
+
+
+def parse_package(line: str) -> tuple[str, list[float]]:
+    """Разобрать строку пакета вида `RUN 15000 1 75` или `RUN,15000,1,75`."""
+    workout_type, *data = line.replace(',', ' ').split()
+    return workout_type, [float(value) for value in data]
+
+
+def iter_packages(lines: Iterable[str]) -> Iterator[tuple[str, list[float]]]:
+    """Лениво читать пакеты из строк, пропуская пустые и комментарии."""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield parse_package(line)
+
+
+def iter_chunks(items: Iterable, size: int) -> Iterator[list]:
+    """Разбить поток на списки длиной не больше `size`."""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def package_columns(packages: Sequence[tuple[str, Sequence[float]]]):
+    """Переложить пакеты в столбцы для `calculate_batch`.
+
+    Недостающие у коротких пакетов поля заполняются нулями.
+    """
+    types = [workout_type for workout_type, _ in packages]
+    width = max((len(data) for _, data in packages), default=0)
+    columns = [[0.0] * len(packages) for _ in range(width)]
+    for row, (_, data) in enumerate(packages):
+        for column, value in zip(columns, data):
+            column[row] = value
+    return types, columns
+
+
+def calculate_packages(packages: Sequence[tuple[str, Sequence[float]]],
+                       on_error: Optional[Callable[[int, Exception],
+                                                   None]] = None,
+                       on_reject: Optional[Callable[[str, Sequence[float],
+                                                     str], None]] = None):
+    """Проверить пакеты и рассчитать их столбцами.
+
+    Каждый пакет проверяется декодером, как в `read_package`, поэтому
+    результат строки не зависит от соседей по пачке. Строки с
+    бесконечным или неопределенным результатом (нулевая длительность
+    или рост) пересчитываются объектами, чтобы выбросить ту же ошибку,
+    что и `show_training_info`. Возвращает коды, столбцы пакетов и
+    дистанцию, скорость и калории.
+
+    Если передан `on_error`, испорченный пакет не прерывает пачку:
+    вызывается `on_error(row, error)` с номером пакета в `packages`, а
+    сам пакет в результат не попадает.
+
+    Если передан `on_reject`, пакеты еще и проверяются на правдоподобие,
+    как в `validate_columns`, на тех же столбцах, что и расчет: брак
+    передается в `on_reject(workout_type, data, reason)` и в результат
+    не попадает. Пакеты неизвестного вида, с неверным числом полей или
+    не числами в полях тогда тоже брак (`type`, `arity`, `value`), а не
+    ошибка; о таком браке `on_reject` узнает раньше, чем о браке по
+    правилам. С NumPy правило `speed` берет уже рассчитанную скорость.
+    """
+    if on_reject is None:
+        rows = _measured('dispatch', 'batch', len(packages), _check_packages,
+                         packages, on_error)
+    else:
+        rows = _measured('dispatch', 'batch', len(packages), _shaped_rows,
+                         packages, on_reject)
+    if len(rows) < len(packages):
+        packages = [packages[row] for row in rows]
+        on_error = _renumbered(on_error, rows)
+    types, columns = package_columns(packages)
+    np = _numpy()
+    if np is None:
+        return _calculate_package_rows(packages, types, columns, on_error,
+                                       on_reject)
+    type_array = np.asarray(types)
+    arrays = [np.asarray(column, dtype=np.float64) for column in columns]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results = calculate_batch(type_array, *arrays)
+    if on_reject is not None:
+        codes = _reason_codes(np, type_array, arrays, results[1])
+        if codes.any():
+            kept = _report_rejects(packages, codes.tolist(), on_reject)
+            packages = [packages[row] for row in kept]
+            on_error = _renumbered(on_error, kept)
+            types = [types[row] for row in kept]
+            columns = [column[kept].tolist() for column in arrays]
+            results = tuple(column[kept] for column in results)
+    finite = np.logical_and.reduce([np.isfinite(column)
+                                    for column in results])
+    suspects = np.flatnonzero(~finite).tolist()
+    if suspects and _recheck_packages(packages, suspects, on_error):
+        return calculate_packages(_without(packages, suspects))
+    return (types, columns) + results
+
+
+def _calculate_package_rows(packages, types, columns, on_error, on_reject):
+    """`calculate_packages` для проверенных пакетов без NumPy."""
+    if on_reject is not None:
+        reasons = [_reason_code(reason or '')
+                   for reason in validate_columns(types, *columns)]
+        if any(reasons):
+            kept = _report_rejects(packages, reasons, on_reject)
+            packages = [packages[row] for row in kept]
+            on_error = _renumbered(on_error, kept)
+            types, columns = package_columns(packages)
+    try:
+        return (types, columns) + calculate_batch(types, *columns)
+    except ArithmeticError:
+        if on_error is None:
+            raise
+    failed = _recheck_packages(packages, range(len(packages)), on_error)
+    return calculate_packages(_without(packages, failed))
+
+
+def _check_packages(packages: Sequence[tuple[str, Sequence[float]]],
+                    on_error: Optional[Callable[[int, Exception], None]]
+                    ) -> Sequence[int]:
+    """Номера пакетов, прошедших проверку декодером."""
+    if on_error is None:
+        for workout_type, data in packages:
+            (DECODERS.get(workout_type)
+             or get_decoder(workout_type)).check(data)
+        return range(len(packages))
+    rows = []
+    for row, (workout_type, data) in enumerate(packages):
+        try:
+            (DECODERS.get(workout_type)
+             or get_decoder(workout_type)).check(data)
+        except PacketError as error:
+            on_error(row, error)
+        else:
+            rows.append(row)
+    return rows
+
+
+def _shaped_rows(packages: Sequence[tuple[str, Sequence[float]]],
+                 on_reject: Callable[[str, Sequence[float], str], None]
+                 ) -> list[int]:
+    """Номера пакетов известного вида с нужным числом конечных полей.
+
+    Остальные передаются в `on_reject` с причиной `type`, `arity` или
+    `value`.
+    """
+    rows = []
+    for row, (workout_type, data) in enumerate(packages):
+        try:
+            (DECODERS.get(workout_type)
+             or get_decoder(workout_type)).check(data)
+        except PacketError:
+            on_reject(workout_type, data,
+                      _shape_problem(workout_type, data))
+        else:
+            rows.append(row)
+    return rows
+
+
+def _report_rejects(packages: Sequence[tuple[str, Sequence[float]]],
+                    codes: Sequence[int],
+                    on_reject: Callable[[str, Sequence[float], str], None]
+                    ) -> list[int]:
+    """Передать брак в `on_reject` и вернуть номера остальных пакетов."""
+    kept = []
+    for row, code in enumerate(codes):
+        if code:
+            on_reject(*packages[row], _REASONS[code])
+        else:
+            kept.append(row)
+    return kept
+
+
+def _renumbered(on_error: Optional[Callable[[int, Exception], None]],
+                rows: Sequence[int]
+                ) -> Optional[Callable[[int, Exception], None]]:
+    """`on_error` для подвыборки `rows`: номер строки - исходный."""
+    if on_error is None:
+        return None
+    return lambda row, error: on_error(rows[row], error)
+
+
+def _without(packages: Sequence[tuple[str, Sequence[float]]],
+             rows: Iterable[int]) -> list[tuple[str, Sequence[float]]]:
+    """Пакеты без строк `rows`."""
+    rows = set(rows)
+    return [package for row, package in enumerate(packages)
+            if row not in rows]
+
+
+def _recheck_packages(packages: Sequence[tuple[str, Sequence[float]]],
+                      suspects: Iterable[int],
+                      on_error: Optional[Callable[[int, Exception], None]]
+                      ) -> list[int]:
+    """Пересчитать подозрительные строки объектами.
+
+    Ошибку расчета выбрасывает или передает в `on_error`; возвращает
+    номера упавших строк.
+    """
+    failed = []
+    for row in suspects:
+        try:
+            read_package(*packages[row]).show_training_info()
+        except Exception as error:
+            if on_error is None:
+                raise
+            on_error(row, error)
+            failed.append(row)
+    return failed
+
+
+def calculate_results(packages: Sequence[tuple[str, Sequence[float]]],
+                      on_error: Optional[Callable[[int, Exception],
+                                                  None]] = None,
+                      on_reject: Optional[Callable[[str, Sequence[float],
+                                                    str], None]] = None):
+    """Рассчитать поля `InfoMessage` для пачки пакетов столбцами.
+
+    `on_error` и `on_reject` - как в `calculate_packages`.
+    """
+    if not packages:
+        return [], [], [], [], []
+    types, columns, distance, speed, calories = calculate_packages(
+        packages, on_error, on_reject)
+    names = [WORKOUT_CLASSES[workout_type].__name__
+             for workout_type in types]
+    return (names, columns[1] if columns else [], distance.tolist(),
+            speed.tolist(), calories.tolist())
+
+
+def calculate_messages(packages: Sequence[tuple[str, Sequence[float]]],
+                       on_error: Optional[Callable[[int, Exception],
+                                                   None]] = None,
+                       on_reject: Optional[Callable[[str, Sequence[float],
+                                                     str], None]] = None
+                       ) -> list[str]:
+    """Рассчитать сообщения для пачки пакетов без объектов `Training`.
+
+    `on_error` и `on_reject` - как в `calculate_packages`.
+    """
+    return format_columns(*calculate_results(packages, on_error, on_reject))
+
+
+def process_stream(lines: Iterable[str], output: TextIO = sys.stdout,
+                   chunk_size: int = 1000, flush_every: int = 1,
+                   on_error: Optional[Callable[[str, Exception],
+                                               None]] = None) -> int:
+    """Обработать поток пакетов с постоянным расходом памяти.
+
+    Пакеты считаются пачками по `chunk_size`, готовые сообщения копятся
+    не более чем для `flush_every` пачек и пишутся в `output` одним
+    вызовом. Следующие строки читаются только после записи, поэтому
+    медленный получатель притормаживает и чтение. Возвращает число
+    обработанных пакетов.
+
+    Если передан `on_error`, испорченная строка (не разбирается или ее
+    пакет не считается) не останавливает поток: вызывается
+    `on_error(line, error)`, и строка пропускается. Без него ошибка
+    выбрасывается, но сообщения, готовые до нее, сначала записываются.
+    """
+    processed = 0
+    pending = []
+    chunks = iter_chunks(_parse_lines(lines, on_error), chunk_size)
+    try:
+        for number, chunk in enumerate(chunks, start=1):
+            package_error = None if on_error is None else (
+                lambda row, error: on_error(chunk[row][0], error))
+            results = calculate_results([package for _, package in chunk],
+                                        package_error)
+            pending.append(render_columns(*results))
+            processed += len(results[0])
+            if number % flush_every == 0:
+                blocks, pending = pending, []
+                _write_blocks(output, blocks)
+    finally:
+        if pending:
+            _write_blocks(output, pending)
+    return processed
+
+
+def _parse_lines(lines: Iterable[str],
+                 on_error: Optional[Callable[[str, Exception], None]]
+                 ) -> Iterator[tuple[str, tuple[str, list[float]]]]:
+    """Строки пакетов вместе с разобранными пакетами, как `iter_packages`.
+
+    Строку, которая не разбирается, передает в `on_error`, если он есть.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            package = parse_package(line)
+        except ValueError as error:
+            if on_error is None:
+                raise
+            on_error(line, error)
+        else:
+            yield line, package
+
+
+def _write_blocks(output: TextIO, blocks: list[str]) -> None:
+    """Записать готовые блоки текста одним вызовом и сбросить буфер."""
+    output.write(''.join(blocks))
+    output.flush()
+
+
+def process_parallel(packages: Iterable[tuple[str, Sequence[float]]],
+                     workers: Optional[int] = None, batch_size: int = 1000,
+                     ordered: bool = True) -> Iterator[str]:
+    """Рассчитать сообщения для пакетов в пуле процессов.
+
+    Пакеты отправляются воркерам пачками по `batch_size`, чтобы
+    сериализация не съедала выигрыш. В работе держится не больше двух
+    пачек на воркер, так что поток пакетов может быть бесконечным.
+    При `ordered=False` сообщения отдаются по мере готовности пачек.
+    """
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    workers = workers or os.cpu_count() or 1
+    chunks = iter_chunks(packages, batch_size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque(
+            executor.submit(calculate_messages, chunk)
+            for chunk in islice(chunks, workers * 2))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                yield from future.result()
+                for chunk in islice(chunks, 1):
+                    pending.append(executor.submit(calculate_messages, chunk))
+
+
+class SharedResults:
+    """Результаты расчета в разделяемой памяти, по строке на пакет.
+
+    Столбцы дистанции, скорости и калорий (float64 длиной `count`) лежат
+    подряд в одном блоке `multiprocessing.shared_memory`. Создатель блока
+    удаляет его при выходе из `with`; воркеры подключаются по `name`.
+    """
+
+    COLUMNS = 3
+    ITEM_SIZE = 8
+
+    def __init__(self, count: int, name: Optional[str] = None) -> None:
+        from multiprocessing import shared_memory
+
+        self.count = count
+        self.owner = name is None
+        size = max(1, count * self.COLUMNS * self.ITEM_SIZE)
+        self._memory = shared_memory.SharedMemory(
+            name=name, create=self.owner, size=size)
+
+    @property
+    def name(self) -> str:
+        """Имя блока разделяемой памяти для подключения воркеров."""
+        return self._memory.name
+
+    def write(self, start: int, distance, speed, calories) -> None:
+        """Записать столбцы пачки, начиная со строки `start`."""
+        for index, values in enumerate((distance, speed, calories)):
+            offset = (index * self.count + start) * self.ITEM_SIZE
+            data = values.tobytes()
+            self._memory.buf[offset:offset + len(data)] = data
+
+    def columns(self) -> tuple:
+        """Столбцы дистанции, скорости и калорий как `memoryview`.
+
+        Представления нужно освободить до закрытия блока.
+        """
+        values = self._memory.buf[
+            :self.count * self.COLUMNS * self.ITEM_SIZE].cast('d')
+        return tuple(values[index * self.count:(index + 1) * self.count]
+                     for index in range(self.COLUMNS))
+
+    def render(self, packages: Sequence[tuple[str, Sequence[float]]],
+               chunk_size: int = 65536) -> Iterator[str]:
+        """Текст сообщений по данным пакетов и результатам из буфера."""
+        for start in range(0, self.count, chunk_size):
+            stop = min(start + chunk_size, self.count)
+            chunk = packages[start:stop]
+            names = [WORKOUT_CLASSES[workout_type].__name__
+                     for workout_type, _ in chunk]
+            durations = [data[1] for _, data in chunk]
+            results = [column[start:stop].tolist()
+                       for column in self.columns()]
+            yield render_columns(names, durations, *results)
+
+    def close(self) -> None:
+        """Отключиться от блока; создатель также удаляет его."""
+        self._memory.close()
+        if self.owner:
+            self._memory.unlink()
+
+    def __enter__(self) -> 'SharedResults':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _calculate_shared(name: str, count: int, start: int,
+                      packages: Sequence[tuple[str, Sequence[float]]]
+                      ) -> int:
+    """Рассчитать пачку в воркере и записать ее в разделяемую память."""
+    results = SharedResults(count, name)
+    try:
+        results.write(start, *calculate_packages(packages)[2:])
+    finally:
+        results.close()
+    return len(packages)
+
+
+def process_shared(packages: Sequence[tuple[str, Sequence[float]]],
+                   workers: Optional[int] = None,
+                   batch_size: int = 10000) -> SharedResults:
+    """Рассчитать пакеты в пуле процессов с выдачей через общую память.
+
+    Родитель заранее выделяет буфер на все пакеты, воркеры пишут в него
+    результаты своих пачек по номерам строк и возвращают только число
+    записанных строк - объекты результатов между процессами не ходят.
+    Возвращенный `SharedResults` нужно закрыть после использования.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = SharedResults(len(packages))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_calculate_shared, results.name, len(packages),
+                                start, packages[start:start + batch_size])
+                for start in range(0, len(packages), batch_size)
+            ]
+            for future in futures:
+                future.result()
+    except BaseException:
+        results.close()
+        raise
+    return results
+
+
+PACKET_MAGIC = b'HWPK'
+PACKET_VERSION = 1
+# Форматы `struct` заголовка и записи файла. Размеры записаны заранее,
+# чтобы импорт модуля не загружал struct.
+PACKET_HEADER_FORMAT = '<4sHH'
+PACKET_HEADER_SIZE = 8
+# Код вида тренировки и поля самого длинного пакета (`Swimming`).
+PACKET_RECORD_FORMAT = '<4s4x5d'
+PACKET_RECORD_SIZE = 48
+PACKET_FIELDS = 5
+
+
+def write_packets(path: str,
+                  packages: Iterable[tuple[str, Sequence[float]]],
+                  chunk_size: int = 10000) -> int:
+    """Записать пакеты в бинарный файл фиксированного формата.
+
+    Возвращает число записанных пакетов.
+    """
+    import struct
+
+    record = struct.Struct(PACKET_RECORD_FORMAT)
+    count = 0
+    with open(path, 'wb') as file:
+        file.write(_packet_header())
+        for chunk in iter_chunks(packages, chunk_size):
+            file.write(b''.join(_pack_record(record, *package)
+                                for package in chunk))
+            count += len(chunk)
+    return count
+
+
+def _packet_header() -> bytes:
+    """Заголовок файла пакетов."""
+    import struct
+
+    return struct.pack(PACKET_HEADER_FORMAT, PACKET_MAGIC, PACKET_VERSION,
+                       PACKET_RECORD_SIZE)
+
+
+def _pack_record(record: struct.Struct, workout_type: str,
+                 data: Sequence[float]) -> bytes:
+    """Упаковать один пакет в запись файла формата `record`."""
+    if len(data) > PACKET_FIELDS:
+        raise ValueError(f'В пакете больше {PACKET_FIELDS} полей')
+    padding = (0.0,) * (PACKET_FIELDS - len(data))
+    return record.pack(workout_type.encode('ascii'), *data, *padding)
+
+
+def convert_packages(lines: Iterable[str], path: str) -> int:
+    """Перевести текстовый дамп пакетов в бинарный формат."""
+    return write_packets(path, iter_packages(lines))
+
+
+class PacketFile:
+    """Бинарный файл пакетов, отображенный в память.
+
+    Столбцы полей отдаются как представления файла без копирования:
+    массивы NumPy, если он установлен, иначе `memoryview`. Файл можно
+    закрыть только после того, как столбцы перестали использоваться.
+    """
+
+    def __init__(self, path: str) -> None:
+        import mmap
+
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._mmap[:PACKET_HEADER_SIZE]
+        if header != _packet_header():
+            self._mmap.close()
+            raise ValueError(f'{path} не является файлом пакетов')
+        size, remainder = divmod(len(self._mmap) - PACKET_HEADER_SIZE,
+                                 PACKET_RECORD_SIZE)
+        if remainder:
+            self._mmap.close()
+            raise ValueError(f'Файл {path} обрезан')
+        self.count = size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def types(self, start: int = 0, stop: Optional[int] = None):
+        """Коды видов тренировок записей с `start` по `stop`."""
+        start, stop, _ = slice(start, stop).indices(self.count)
+        np = _numpy()
+        if np is not None:
+            return self._records(np)[start:stop]['type'].astype(str)
+        offset = PACKET_HEADER_SIZE
+        size = PACKET_RECORD_SIZE
+        return [
+            self._mmap[position:position + 4].rstrip(b'\0').decode('ascii')
+            for position in range(offset + start * size,
+                                  offset + stop * size, size)
+        ]
+
+    def columns(self, start: int = 0, stop: Optional[int] = None):
+        """Столбцы полей записей с `start` по `stop` без копирования."""
+        start, stop, _ = slice(start, stop).indices(self.count)
+        np = _numpy()
+        if np is not None:
+            fields = self._records(np)[start:stop]['fields']
+            return tuple(fields[:, index] for index in range(PACKET_FIELDS))
+        step = PACKET_RECORD_SIZE // 8
+        values = memoryview(self._mmap)[PACKET_HEADER_SIZE:].cast('d')
+        values = values[start * step:stop * step]
+        return tuple(values[index + 1::step]
+                     for index in range(PACKET_FIELDS))
+
+    def calculate(self, start: int = 0, stop: Optional[int] = None):
+        """Рассчитать дистанцию, скорость и калории для диапазона записей."""
+        return calculate_batch(self.types(start, stop),
+                               *self.columns(start, stop))
+
+    def _records(self, np):
+        """Структурированный массив NumPy поверх отображения файла."""
+        dtype = np.dtype([('type', 'S4'), ('padding', 'V4'),
+                          ('fields', '<f8', (PACKET_FIELDS,))])
+        return np.frombuffer(self._mmap, dtype=dtype, count=self.count,
+                             offset=PACKET_HEADER_SIZE)
+
+    def close(self) -> None:
+        """Закрыть отображение файла."""
+        self._mmap.close()
+
+    def __enter__(self) -> 'PacketFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def percentile(sorted_values: Sequence[float], share: float) -> float:
+    """Перцентиль отсортированной выборки методом ближайшего ранга."""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[rank]
+
+
+class ServerStats:
+    """Пропускная способность и задержки обработки пакетов."""
+
+    def __init__(self, window: int = 10000) -> None:
+        from collections import deque
+
+        self.started = time.monotonic()
+        self.processed = 0
+        self.errors = 0
+        self.latencies: deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float, error: bool = False) -> None:
+        """Учесть обработанный пакет."""
+        self.processed += 1
+        self.errors += error
+        self.latencies.append(latency)
+
+    def snapshot(self) -> dict[str, float]:
+        """Текущие показатели; задержки в секундах по последним пакетам."""
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        return {
+            'processed': self.processed,
+            'errors': self.errors,
+            'throughput': self.processed / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+        }
+
+    def report(self) -> str:
+        """Строка показателей для журнала сервера."""
+        snapshot = self.snapshot()
+        return (f'processed={snapshot["processed"]} '
+                f'errors={snapshot["errors"]} '
+                f'throughput={snapshot["throughput"]:.1f}/s '
+                + ' '.join(f'{name}={snapshot[name] * 1000:.3f}ms'
+                           for name in ('p50', 'p90', 'p99')))
+
+
+class PacketServer:
+    """Асинхронный сервер приема пакетов по TCP или Unix-сокету.
+
+    Клиент шлет пакеты строками (`RUN 15000 1 75`), на каждую строку
+    сервер в том же порядке отвечает строкой сообщения или `ERROR: ...`.
+    Пакеты со всех соединений собираются в пачки до `batch_size` штук,
+    ожидая добора не дольше `batch_delay` секунд. Если передан
+    `executor`, пачки считаются в нем, не занимая цикл событий.
+
+    Очередь пакетов сервера ограничена `max_pending`, очередь ответов
+    соединения - `max_replies`: если расчет или клиент не успевают,
+    сервер перестает читать из соединения, а не копит строки в памяти.
+    """
+
+    def __init__(self, batch_size: int = 1000, batch_delay: float = 0.002,
+                 executor=None, max_pending: int = 10000,
+                 max_replies: int = 1000) -> None:
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.executor = executor
+        self.max_pending = max_pending
+        self.max_replies = max_replies
+        self.stats = ServerStats()
+        self._server = None
+        self._batcher = None
+        self._queue = None
+        self._batch = []
+        self._closing = False
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0,
+                    path: Optional[str] = None):
+        """Начать прием соединений; `path` включает Unix-сокет."""
+        import asyncio
+
+        self._queue = asyncio.Queue(self.max_pending)
+        self._batcher = asyncio.create_task(self._run_batches())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, host, port)
+        return self._server
+
+    @property
+    def address(self):
+        """Адрес, на котором слушает сервер."""
+        return self._server.sockets[0].getsockname()
+
+    async def close(self) -> None:
+        """Остановить прием соединений и обработку пачек.
+
+        Пакеты, которые не успели рассчитать, получают ответ `ERROR`, а
+        соединения перестают читать новые строки.
+        """
+        import asyncio
+
+        self._closing = True
+        self._server.close()
+        self._batcher.cancel()
+        await asyncio.wait([self._batcher])
+        stopped = _error_reply(ConnectionAbortedError('Сервер остановлен'))
+        pending = self._batch
+        while pending:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_result(stopped)
+            # Забираем очередь и даем дописать соединениям, ждавшим места.
+            pending = [self._queue.get_nowait()
+                       for _ in range(self._queue.qsize())]
+            await asyncio.sleep(0)
+        self._batch = []
+        await self._server.wait_closed()
+
+    async def __aenter__(self) -> 'PacketServer':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def _handle(self, reader: 'asyncio.StreamReader',
+                      writer: 'asyncio.StreamWriter') -> None:
+        """Читать пакеты соединения и ставить их в общую очередь."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        replies = asyncio.Queue(self.max_replies)
+        replier = asyncio.create_task(self._write_replies(replies, writer))
+        try:
+            async for line in reader:
+                if self._closing:
+                    break
+                if not line.strip():
+                    continue
+                future = loop.create_future()
+                await replies.put(future)
+                await self._queue.put((line, time.perf_counter(), future))
+        finally:
+            await replies.put(None)
+            await replier
+
+    async def _write_replies(self, replies: 'asyncio.Queue',
+                             writer: 'asyncio.StreamWriter') -> None:
+        """Отправлять ответы соединению в порядке пакетов.
+
+        Если клиент отключился, ответы дочитываются без отправки, чтобы
+        чтение соединения не встало на полной очереди ответов.
+        """
+        connected = True
+        while (future := await replies.get()) is not None:
+            reply = await future
+            if connected:
+                try:
+                    writer.write(reply + b'\n')
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _run_batches(self) -> None:
+        """Собирать пакеты в пачки и рассчитывать их."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            lines = [line for line, _, _ in batch]
+            try:
+                replies = await loop.run_in_executor(
+                    self.executor, _reply_lines, lines
+                ) if self.executor else _reply_lines(lines)
+            except Exception as error:
+                replies = [_error_reply(error)] * len(lines)
+            finished = time.perf_counter()
+            for (_, started, future), reply in zip(batch, replies):
+                self.stats.record(finished - started,
+                                  reply.startswith(b'ERROR'))
+                if not future.done():
+                    future.set_result(reply)
+            self._batch = []
+
+
+def _reply_lines(lines: list[bytes]) -> list[bytes]:
+    """Ответы сервера на пачку строк с пакетами.
+
+    Каждая строка разбирается и проверяется отдельно, исправные пакеты
+    считаются одним вызовом `calculate_messages`.
+    """
+    replies = [None] * len(lines)
+    packages = []
+    rows = []
+    for row, line in enumerate(lines):
+        try:
+            packages.append(parse_package(line.decode()))
+        except ValueError as error:
+            replies[row] = _error_reply(error)
+        else:
+            rows.append(row)
+
+    def reject(index: int, error: Exception) -> None:
+        replies[rows[index]] = _error_reply(error)
+
+    messages = iter(calculate_messages(packages, on_error=reject))
+    return [next(messages).encode() if reply is None else reply
+            for reply in replies]
+
+
+def _error_reply(error: Exception) -> bytes:
+    """Строка ответа об ошибке разбора или расчета пакета."""
+    return f'ERROR: {type(error).__name__}: {error}'.encode()
+
+
+async def request_packets(lines: Iterable[str], host: str = '127.0.0.1',
+                          port: int = 0,
+                          path: Optional[str] = None) -> list[str]:
+    """Отправить пакеты серверу и вернуть его ответы."""
+    import asyncio
+
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    lines = [line for line in lines if line.strip()]
+    writer.write(''.join(line + '\n' for line in lines).encode())
+    await writer.drain()
+    replies = [(await reader.readline()).decode().rstrip('\n')
+               for _ in lines]
+    writer.close()
+    await writer.wait_closed()
+    return replies
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8765,
+                path: Optional[str] = None,
+                report_every: Optional[float] = 60.0,
+                output: Optional[TextIO] = None, **options) -> None:
+    """Запустить сервер пакетов до отмены задачи.
+
+    Показатели `ServerStats.report` пишутся в `output` (по умолчанию
+    stderr) каждые `report_every` секунд, по сигналу SIGUSR1 и при
+    остановке.
+    """
+    import asyncio
+    import signal
+
+    def report() -> None:
+        (output or sys.stderr).write(server.stats.report() + '\n')
+
+    async def report_periodically() -> None:
+        while True:
+            await asyncio.sleep(report_every)
+            report()
+
+    loop = asyncio.get_running_loop()
+    async with PacketServer(**options) as server:
+        await server.start(host, port, path)
+        reporter = (asyncio.create_task(report_periodically())
+                    if report_every else None)
+        usr1 = getattr(signal, 'SIGUSR1', None)
+        try:
+            if usr1 is not None:
+                loop.add_signal_handler(usr1, report)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Сигналы доступны только в главном потоке на Unix.
+            usr1 = None
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if usr1 is not None:
+                loop.remove_signal_handler(usr1)
+            if reporter is not None:
+                reporter.cancel()
+            report()
+
+
+class ResultCache:
+    """LRU-кэш результатов расчета по ключу `(workout_type, data)`.
+
+    Хранит поля `InfoMessage`, вытесняет самые давние записи сверх
+    `maxsize` и, если задан `ttl`, не отдает записи старше `ttl` секунд.
+    """
+
+    def __init__(self, maxsize: int = 100_000, ttl: Optional[float] = None,
+                 clock=time.monotonic) -> None:
+        from collections import OrderedDict
+        from operator import attrgetter
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: OrderedDict = OrderedDict()
+        self._fields = attrgetter(*MESSAGE_ATTRIBUTES.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, workout_type: str, data: Sequence[float]):
+        """Поля `InfoMessage` из кэша или None."""
+        key = (workout_type, tuple(data))
+        item = self._items.get(key)
+        if item is not None:
+            expires, fields = item
+            if expires is None or expires > self.clock():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return fields
+            del self._items[key]
+        self.misses += 1
+        return None
+
+    def put(self, workout_type: str, data: Sequence[float],
+            fields: tuple) -> None:
+        """Сохранить поля `InfoMessage` для пакета."""
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        key = (workout_type, tuple(data))
+        self._items[key] = (expires, fields)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def show_training_info(self, workout_type: str,
+                           data: Sequence[float]) -> InfoMessage:
+        """`read_package(...).show_training_info()` через кэш."""
+        fields = self.get(workout_type, data)
+        if fields is None:
+            info = read_package(workout_type, data).show_training_info()
+            fields = self._fields(info)
+            self.put(workout_type, data, fields)
+            return info
+        return InfoMessage(*fields)
+
+    def calculate_messages(self,
+                           packages: Sequence[tuple[str, Sequence[float]]]
+                           ) -> list[str]:
+        """`calculate_messages` через кэш: считаются только промахи."""
+        rows = [self.get(workout_type, data)
+                for workout_type, data in packages]
+        misses = [index for index, row in enumerate(rows) if row is None]
+        if misses:
+            computed = zip(*calculate_results(
+                [packages[index] for index in misses]))
+            for index, fields in zip(misses, computed):
+                rows[index] = fields
+                self.put(*packages[index], fields)
+        return [MESSAGE_FORMAT % tuple(row[index] for index in _MESSAGE_ORDER)
+                for row in rows]
+
+    def stats(self) -> dict[str, int]:
+        """Счетчики попаданий, промахов и вытеснений."""
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def clear(self) -> None:
+        """Очистить кэш, не сбрасывая счетчики."""
+        self._items.clear()
+
+
+EXPORT_COLUMNS = ('training_type', 'duration', 'distance', 'speed',
+                  'calories')
+
+
+class CsvResultWriter:
+    """Запись результатов в CSV средствами стандартной библиотеки."""
+
+    def __init__(self, path: str) -> None:
+        import csv
+
+        self._file = open(path, 'w', newline='', buffering=1 << 20)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, columns: Sequence[Sequence]) -> None:
+        """Записать пачку результатов, заданную столбцами."""
+        self._writer.writerows(zip(*columns))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ArrowResultWriter:
+    """Запись результатов в файл Arrow IPC (нужен pyarrow)."""
+
+    def __init__(self, path: str) -> None:
+        pa = _pyarrow()
+        self._schema = _arrow_schema(pa)
+        self._writer = pa.ipc.new_file(path, self._schema)
+
+    def write(self, columns: Sequence[Sequence]) -> None:
+        """Записать пачку результатов одним пакетом записей Arrow."""
+        self._writer.write_batch(_arrow_batch(self._schema, columns))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class ParquetResultWriter:
+    """Запись результатов в Parquet (нужен pyarrow)."""
+
+    def __init__(self, path: str) -> None:
+        import pyarrow.parquet
+
+        self._schema = _arrow_schema(_pyarrow())
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, columns: Sequence[Sequence]) -> None:
+        """Записать пачку результатов отдельной группой строк."""
+        self._writer.write_batch(_arrow_batch(self._schema, columns))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def _pyarrow():
+    """Модуль pyarrow или понятная ошибка, если он не установлен."""
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError('Для Arrow и Parquet установите pyarrow') from error
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    """Схема Arrow для полей `InfoMessage`."""
+    return pa.schema([(EXPORT_COLUMNS[0], pa.string())]
+                     + [(name, pa.float64()) for name in EXPORT_COLUMNS[1:]])
+
+
+def _arrow_batch(schema, columns: Sequence[Sequence]):
+    """Пакет записей Arrow из столбцов результатов."""
+    import pyarrow
+
+    return pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array(column, type=field.type)
+         for column, field in zip(columns, schema)], schema=schema)
+
+
+RESULT_WRITERS = {
+    'csv': CsvResultWriter,
+    'arrow': ArrowResultWriter,
+    'parquet': ParquetResultWriter,
+}
+
+
+def export_results(packages: Iterable[tuple[str, Sequence[float]]],
+                   path: str, file_format: Optional[str] = None,
+                   chunk_size: int = 65536) -> int:
+    """Рассчитать пакеты и выгрузить поля `InfoMessage` столбцами.
+
+    Формат берется из `file_format` или расширения файла (`.csv`, `.arrow`,
+    `.parquet`). Пакеты считаются и пишутся пачками по `chunk_size`,
+    поэтому расход памяти не зависит от числа строк. Значения пишутся
+    с полной точностью, без округления сообщения. Возвращает число
+    выгруженных строк.
+    """
+    file_format = (file_format
+                   or os.path.splitext(path)[1].lstrip('.').lower())
+    if file_format not in RESULT_WRITERS:
+        raise ValueError(f'Неизвестный формат выгрузки {file_format!r}')
+    writer = RESULT_WRITERS[file_format](path)
+    count = 0
+    try:
+        for chunk in iter_chunks(packages, chunk_size):
+            writer.write(calculate_results(chunk))
+            count += len(chunk)
+    finally:
+        writer.close()
+    return count
+
+
+class ResultStore:
+    """Хранилище рассчитанных тренировок в SQLite.
+
+    На каждую тренировку хранится строка: пользователь, метка времени
+    (секунды Unix), код вида и поля `InfoMessage`. Индексы по виду и
+    времени и по пользователю, виду и времени позволяют выбирать диапазоны
+    без полного просмотра таблицы. Чтение отдает пачки столбцов: строки
+    SQLite перекладываются в массивы, `Training` и `InfoMessage` не
+    создаются.
+    """
+
+    COLUMNS = ('user_id', 'timestamp', 'workout_type', 'duration',
+               'distance', 'speed', 'calories')
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS results ('
+        'user_id TEXT NOT NULL, timestamp REAL NOT NULL, '
+        'workout_type TEXT NOT NULL, duration REAL NOT NULL, '
+        'distance REAL NOT NULL, speed REAL NOT NULL, '
+        'calories REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS results_type_time '
+        'ON results (workout_type, timestamp)',
+        'CREATE INDEX IF NOT EXISTS results_user_type_time '
+        'ON results (user_id, workout_type, timestamp)',
+    )
+
+    def __init__(self, path: str = ':memory:') -> None:
+        import sqlite3
+
+        self.connection = sqlite3.connect(path)
+        if path != ':memory:':
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def add_packages(self, records: Iterable[tuple], chunk_size: int = 65536
+                     ) -> int:
+        """Рассчитать и сохранить записи `(user_id, timestamp, код, данные)`.
+
+        Пачка из `chunk_size` записей считается `calculate_results` и
+        вставляется одной транзакцией. Возвращает число сохраненных строк.
+        """
+        count = 0
+        for chunk in iter_chunks(records, chunk_size):
+            users, timestamps, types, packages = zip(*(
+                (str(user_id), timestamp, workout_type,
+                 (workout_type, data))
+                for user_id, timestamp, workout_type, data in chunk))
+            _, durations, *values = calculate_results(packages)
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    zip(users, timestamps, types, durations, *values))
+            count += len(chunk)
+        return count
+
+    def query(self, workout_type: Optional[str] = None, user_id=None,
+              start: Optional[float] = None, stop: Optional[float] = None,
+              batch_size: int = 65536) -> Iterator[tuple]:
+        """Выбрать тренировки пачками столбцов в порядке `COLUMNS`.
+
+        Условия необязательны; время - полуинтервал `[start, stop)`.
+        Строки идут по возрастанию метки времени. Текстовые столбцы
+        отдаются списками, числовые - `array('d')`.
+        """
+        from array import array
+
+        conditions, parameters = [], []
+        for condition, value in (('user_id = ?', user_id),
+                                 ('workout_type = ?', workout_type),
+                                 ('timestamp >= ?', start),
+                                 ('timestamp < ?', stop)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value if condition != 'user_id = ?'
+                                  else str(value))
+        sql = f'SELECT {", ".join(self.COLUMNS)} FROM results'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        cursor = self.connection.execute(sql + ' ORDER BY timestamp',
+                                         parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            users, timestamps, types, *values = zip(*rows)
+            yield (list(users), array('d', timestamps), list(types),
+                   *(array('d', column) for column in values))
+
+    def messages(self, **conditions) -> Iterator[str]:
+        """Сообщения `get_message` для выбранных тренировок."""
+        for _, _, types, *values in self.query(**conditions):
+            names = [WORKOUT_CLASSES[code].__name__ for code in types]
+            yield from format_columns(names, *values)
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self) -> None:
+        """Закрыть соединение с базой."""
+        self.connection.close()
+
+    def __enter__(self) -> 'ResultStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class PacketDeduplicator:
+    """Отсев повторных пакетов до создания объектов `Training`.
+
+    Ключ пакета - хеш кода устройства, вида тренировки и полей. Последние
+    `exact_size` ключей хранятся точно в LRU-множестве. Более старые
+    помнит скользящий фильтр Блума из двух поколений по `capacity` ключей:
+    когда текущее поколение заполнено, оно становится предыдущим, а самое
+    старое сбрасывается. Память ограничена при любой длине потока, но
+    фильтр изредка принимает новый пакет за повтор с вероятностью около
+    `error_rate`; текущую оценку дает `false_positive_rate`.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001,
+                 exact_size: int = 100_000) -> None:
+        from collections import OrderedDict
+
+        self.capacity = capacity
+        self.exact_size = exact_size
+        self.bits = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._current_count = 0
+        self._recent: OrderedDict = OrderedDict()
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.probable_duplicates = 0
+
+    @staticmethod
+    def packet_key(device_id, workout_type: str,
+                   data: Sequence[float]) -> bytes:
+        """Хеш пакета; целые и дробные записи чисел не различаются."""
+        import hashlib
+
+        text = repr((device_id, workout_type, tuple(map(float, data))))
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def is_duplicate(self, device_id, workout_type: str,
+                     data: Sequence[float]) -> bool:
+        """Проверить пакет и запомнить его."""
+        self.seen += 1
+        key = self.packet_key(device_id, workout_type, data)
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self.exact_duplicates += 1
+            return True
+        self._recent[key] = None
+        if len(self._recent) > self.exact_size:
+            self._recent.popitem(last=False)
+        positions = self._positions(key)
+        in_current = self._contains(self._current, positions)
+        if in_current or self._contains(self._previous, positions):
+            self.probable_duplicates += 1
+            return True
+        self._add(positions)
+        return False
+
+    def filter(self, records: Iterable[tuple]) -> Iterator[tuple]:
+        """Пропустить записи `(device_id, workout_type, data)` без повторов."""
+        for record in records:
+            if not self.is_duplicate(*record):
+                yield record
+
+    def _positions(self, key: bytes) -> list[int]:
+        """Номера битов ключа в фильтре (двойное хеширование)."""
+        first = int.from_bytes(key[:8], 'little')
+        second = int.from_bytes(key[8:], 'little') | 1
+        return [(first + index * second) % self.bits
+                for index in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits: bytearray, positions: list[int]) -> bool:
+        """Все ли биты ключа установлены."""
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in positions)
+
+    def _add(self, positions: list[int]) -> None:
+        """Добавить ключ в текущее поколение фильтра."""
+        for position in positions:
+            self._current[position >> 3] |= 1 << (position & 7)
+        self._current_count += 1
+        if self._current_count >= self.capacity:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._current_count = 0
+
+    def false_positive_rate(self) -> float:
+        """Оценка вероятности принять новый пакет за повтор."""
+        rates = [
+            (int.from_bytes(bits, 'little').bit_count() / self.bits)
+            ** self.hashes
+            for bits in (self._current, self._previous)
+        ]
+        return 1 - (1 - rates[0]) * (1 - rates[1])
+
+    def stats(self) -> dict[str, float]:
+        """Счетчики проверенных и отброшенных пакетов."""
+        return {
+            'seen': self.seen,
+            'exact_duplicates': self.exact_duplicates,
+            'probable_duplicates': self.probable_duplicates,
+            'false_positive_rate': self.false_positive_rate(),
+            'memory_bytes': 2 * len(self._current),
+        }
+
+
+# Границы правдоподобных значений полей пакета.
+PLAUSIBLE_DURATION = (0, 24)  # ч, нулевая длительность недопустима
+PLAUSIBLE_WEIGHT = (20, 400)  # кг
+PLAUSIBLE_HEIGHT = (50, 260)  # см
+PLAUSIBLE_POOL_LENGTH = (10, 100)  # м
+# Отношение дистанции по гребкам к дистанции по бассейнам.
+PLAUSIBLE_STROKE_RATIO = (0.25, 4)
+# Предельная средняя скорость по видам тренировок, км/ч.
+MAX_SPEED = {'RUN': 45, 'WLK': 15, 'SWM': 10}
+
+
+def anomaly_rules(workout_type: str) -> list[tuple[str, object]]:
+    """Правила проверки вида тренировки: код причины и условие брака.
+
+    Условие получает столбцы пакета (числа или массивы NumPy) и
+    использует только сравнения и `|`, поэтому работает и построчно,
+    и векторно. Правила идут в порядке проверки: скорость считается
+    последней, когда длительность и поля-делители уже проверены.
+    """
+    training_class = WORKOUT_CLASSES[workout_type]
+    rules = _ANOMALY_RULES.get((workout_type, training_class))
+    if rules is None:
+        rules = _ANOMALY_RULES[workout_type, training_class] = (
+            _anomaly_rules(workout_type, training_class))
+    return rules
+
+
+# Правила `anomaly_rules`, собранные один раз на код и класс.
+_ANOMALY_RULES: dict[tuple[str, type[Training]],
+                     list[tuple[str, object]]] = {}
+
+
+def _anomaly_rules(workout_type: str, training_class: type[Training]
+                   ) -> list[tuple[str, object]]:
+    """Собрать правила `anomaly_rules` для вида тренировки."""
+    fields = training_class.FIELDS
+    rules = [
+        ('action', lambda columns: columns[0] < 0),
+        ('duration', lambda columns: (columns[1] <= PLAUSIBLE_DURATION[0])
+         | (columns[1] > PLAUSIBLE_DURATION[1])),
+        ('weight', lambda columns: (columns[2] < PLAUSIBLE_WEIGHT[0])
+         | (columns[2] > PLAUSIBLE_WEIGHT[1])),
+    ]
+    if 'height' in fields:
+        height = fields.index('height')
+        rules.append(('height', lambda columns: (
+            (columns[height] < PLAUSIBLE_HEIGHT[0])
+            | (columns[height] > PLAUSIBLE_HEIGHT[1]))))
+    if 'length_pool' in fields and 'count_pool' in fields:
+        length = fields.index('length_pool')
+        count = fields.index('count_pool')
+        rules.append(('pool', lambda columns: (
+            (columns[length] < PLAUSIBLE_POOL_LENGTH[0])
+            | (columns[length] > PLAUSIBLE_POOL_LENGTH[1])
+            | (columns[count] <= 0))))
+        rules.append(('strokes', lambda columns: _stroke_ratio_bad(
+            training_class, columns[0], columns[length], columns[count])))
+    if workout_type in MAX_SPEED:
+        rules.append(('speed', lambda columns: training_class.calculate(
+            *columns)[1] > MAX_SPEED[workout_type]))
+    return rules
+
+
+def _stroke_ratio_bad(training_class: type[Training], action, length_pool,
+                      count_pool):
+    """Дистанция по гребкам не сходится с длиной и числом бассейнов."""
+    ratio = action * training_class.LEN_STEP / (length_pool * count_pool)
+    return ((ratio < PLAUSIBLE_STROKE_RATIO[0])
+            | (ratio > PLAUSIBLE_STROKE_RATIO[1]))
+
+
+def validate_package(workout_type: str,
+                     data: Sequence[float]) -> Optional[str]:
+    """Код причины брака пакета или None для правдоподобного пакета.
+
+    Кроме правил `anomaly_rules` пакет может быть отбракован как
+    `type` (неизвестный вид), `arity` (не то число полей) и `value`
+    (поле - не конечное число).
+    """
+    reason = _shape_problem(workout_type, data)
+    if reason is not None:
+        return reason
+    for reason, is_bad in anomaly_rules(workout_type):
+        if is_bad(data):
+            return reason
+    return None
+
+
+def _shape_problem(workout_type: str,
+                   data: Sequence[float]) -> Optional[str]:
+    """Причина брака по виду, числу и типу полей пакета."""
+    if workout_type not in WORKOUT_CLASSES:
+        return 'type'
+    if len(data) != len(WORKOUT_CLASSES[workout_type].FIELDS):
+        return 'arity'
+    try:
+        finite = all(map(isfinite, data))
+    except TypeError:
+        finite = False
+    return None if finite else 'value'
+
+
+# Коды причин брака в массивах `_reason_codes`; 0 - пакет правдоподобен.
+_REASONS = ['']
+_REASON_CODES = {'': 0}
+
+
+def _reason_code(reason: str) -> int:
+    """Код причины брака, новой причине - следующий свободный."""
+    code = _REASON_CODES.get(reason)
+    if code is None:
+        code = _REASON_CODES[reason] = len(_REASONS)
+        _REASONS.append(reason)
+    return code
+
+
+def validate_columns(workout_types: Sequence[str], *columns, speed=None):
+    """Коды причин брака для столбцов пакетов, '' для правдоподобных.
+
+    Столбцы - как у `calculate_batch`. С NumPy правила применяются
+    к маскам видов тренировок целиком, без цикла по строкам; если
+    передана уже рассчитанная скорость строк `speed`, правило `speed`
+    сравнивает с пределом ее, не пересчитывая тренировки.
+    """
+    np = _numpy()
+    if np is None:
+        return [
+            validate_package(workout_type, [
+                column[row] for column in
+                columns[:len(WORKOUT_CLASSES[workout_type].FIELDS)]])
+            if workout_type in WORKOUT_CLASSES else 'type'
+            for row, workout_type in enumerate(workout_types)
+        ]
+    types = np.asarray(workout_types)
+    columns = [np.asarray(column, dtype=np.float64) for column in columns]
+    codes = _reason_codes(np, types, columns, speed)
+    return np.asarray(_REASONS, dtype=object)[codes]
+
+
+def _reason_codes(np, types, columns, speed=None):
+    """Коды причин брака строк (`_REASONS`) массивами NumPy."""
+    codes = np.full(len(types), _reason_code('type'), dtype=np.uint8)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for workout_type in np.unique(types).tolist():
+            training_class = WORKOUT_CLASSES.get(workout_type)
+            if training_class is None:
+                continue
+            rows = np.flatnonzero(types == workout_type)
+            values = [column[rows]
+                      for column in columns[:len(training_class.FIELDS)]]
+            found = np.zeros(len(rows), dtype=np.uint8)
+            finite = np.logical_and.reduce([np.isfinite(column)
+                                            for column in values])
+            found[~finite] = _reason_code('value')
+            for reason, is_bad in anomaly_rules(workout_type):
+                if reason == 'speed' and speed is not None:
+                    bad = speed[rows] > MAX_SPEED[workout_type]
+                else:
+                    bad = is_bad(values)
+                found[(found == 0) & bad] = _reason_code(reason)
+            codes[rows] = found
+    return codes
+
+
+def filter_packages(packages: Iterable[tuple[str, Sequence[float]]],
+                    on_reject=None,
+                    chunk_size: int = 10000
+                    ) -> Iterator[tuple[str, Sequence[float]]]:
+    """Пропустить правдоподобные пакеты, передав брак в `on_reject`.
+
+    `on_reject(workout_type, data, reason)` вызывается для каждого
+    отбракованного пакета. Пакеты проверяются пачками через
+    `validate_columns`. Если пакеты затем считаются, дешевле передать
+    `on_reject` в `calculate_packages`: проверка и расчет пройдут по
+    одним столбцам, а скорость не будет считаться дважды.
+    """
+    for chunk in iter_chunks(packages, chunk_size):
+        reasons = [_shape_problem(*package) for package in chunk]
+        valid = [package for package, reason in zip(chunk, reasons)
+                 if reason is None]
+        if valid:
+            types, columns = package_columns(valid)
+            checked = iter(validate_columns(types, *columns))
+            reasons = [next(checked) if reason is None else reason
+                       for reason in reasons]
+        for package, reason in zip(chunk, reasons):
+            if reason:
+                if on_reject is not None:
+                    on_reject(*package, reason)
+            else:
+                yield package
+
+
+SECONDS_IN_HOUR = 60 * 60
+SECONDS_IN_DAY = 24 * SECONDS_IN_HOUR
+
+
+class WorkoutAggregator:
+    """Накопительные итоги тренировок пользователей по окнам времени.
+
+    Тренировки раскладываются по корзинам длиной `bucket` секунд (по
+    умолчанию сутки) отдельно для каждого пользователя и вида. Хранятся
+    только корзины за последние `window` секунд от самой поздней метки
+    пользователя (по умолчанию неделя), поэтому память не зависит от
+    длины истории. Метки времени - секунды Unix.
+    """
+
+    # Порядок счетчиков в корзине.
+    COUNT, DURATION, DISTANCE, SPEED, CALORIES = range(5)
+
+    def __init__(self, bucket: float = SECONDS_IN_DAY,
+                 window: float = 7 * SECONDS_IN_DAY) -> None:
+        self.bucket = bucket
+        self.window = window
+        self._buckets: dict = {}
+        self._latest: dict = {}
+
+    def add(self, user_id, timestamp: float, training: Training) -> bool:
+        """Учесть тренировку; False, если она старше окна."""
+        latest = max(timestamp, self._latest.get(user_id, timestamp))
+        if timestamp <= latest - self.window:
+            return False
+        self._latest[user_id] = latest
+        info = training.show_training_info()
+        start = timestamp - timestamp % self.bucket
+        buckets = self._buckets.get(user_id)
+        if buckets is None:
+            from collections import OrderedDict
+
+            buckets = self._buckets[user_id] = OrderedDict()
+        types = buckets.get(start)
+        if types is None:
+            types = buckets[start] = {}
+            self._keep_order(buckets, start)
+        totals = types.setdefault(info.training_type,
+                                  [0, 0.0, 0.0, 0.0, 0.0])
+        totals[self.COUNT] += 1
+        totals[self.DURATION] += info.duration
+        totals[self.DISTANCE] += info.distance
+        totals[self.SPEED] += info.speed
+        totals[self.CALORIES] += info.calories
+        self._expire_user(user_id, latest)
+        return True
+
+    def expire(self, now: float) -> None:
+        """Удалить корзины всех пользователей старше окна от `now`."""
+        for user_id in list(self._buckets):
+            self._expire_user(user_id, now)
+
+    @staticmethod
+    def _keep_order(buckets, start: float) -> None:
+        """Поставить новую корзину `start` на место по времени начала.
+
+        Новая корзина добавлена в конец. Если тренировка пришла с
+        опозданием и корзины позже уже есть, они переносятся в конец
+        за ней; таких корзин не больше, чем помещается в окно.
+        """
+        later = []
+        for key in reversed(buckets):
+            if key < start:
+                break
+            if key > start:
+                later.append(key)
+        for key in reversed(later):
+            buckets.move_to_end(key)
+
+    def _expire_user(self, user_id, now: float) -> None:
+        """Удалить устаревшие корзины пользователя.
+
+        Корзины лежат по времени начала, поэтому устаревшие снимаются
+        с начала, а проверка останавливается на первой живой корзине.
+        """
+        buckets = self._buckets[user_id]
+        while buckets and next(iter(buckets)) + self.bucket <= (
+                now - self.window):
+            buckets.popitem(last=False)
+        if not buckets:
+            del self._buckets[user_id]
+            del self._latest[user_id]
+
+    def rollups(self, user_id) -> list[tuple[float, InfoMessage]]:
+        """Итоги по корзинам: начало корзины и сообщение на каждый вид."""
+        return [
+            (start, self._message(training_type, totals))
+            for start, types in self._buckets.get(user_id, {}).items()
+            for training_type, totals in types.items()
+        ]
+
+    def summary(self, user_id) -> list[InfoMessage]:
+        """Итоги по окну: сообщение на каждый вид тренировки.
+
+        Длительность, дистанция и калории суммируются, скорость -
+        средняя по тренировкам.
+        """
+        window: dict = {}
+        for types in self._buckets.get(user_id, {}).values():
+            for training_type, totals in types.items():
+                current = window.setdefault(training_type, [0] * 5)
+                for index, value in enumerate(totals):
+                    current[index] += value
+        return [self._message(training_type, totals)
+                for training_type, totals in window.items()]
+
+    def _message(self, training_type: str, totals: list) -> InfoMessage:
+        """Сообщение с итогами по счетчикам корзин."""
+        return InfoMessage(training_type,
+                           totals[self.DURATION],
+                           totals[self.DISTANCE],
+                           totals[self.SPEED] / totals[self.COUNT],
+                           totals[self.CALORIES])
+
+
+class SampleSession:
+    """Тренировка по потоку отсчетов датчика.
+
+    Датчик присылает отсчеты каждые `sample_seconds` секунд: по значению
+    на каждое поле `SAMPLED_FIELDS` класса (шаги или гребки, для
+    плавания еще и пройденные бассейны). Остальные поля, кроме
+    длительности, задаются при создании сессии по именам.
+
+    Отсчеты не хранятся: `extend` сворачивает новую порцию накопленными
+    суммами в итоги сессии и суммы окон по `window_seconds` секунд,
+    поэтому дополнение не пересчитывает уже полученные данные. Итоги
+    считаются формулами класса тренировки, как пакет `read_package`.
+    """
+
+    def __init__(self, workout_type: str, sample_seconds: float = 1,
+                 window_seconds: float = 60, **fields: float) -> None:
+        from array import array
+
+        self.decoder = get_decoder(workout_type)
+        training_class = self.decoder.training_class
+        self.workout_type = workout_type
+        self.sampled = training_class.SAMPLED_FIELDS
+        constant = [field for field in training_class.FIELDS
+                    if field not in self.sampled and field != 'duration']
+        if set(fields) != set(constant):
+            raise TypeError(f'Сессии {workout_type} нужны поля '
+                            f'{", ".join(constant)}, получено '
+                            f'{", ".join(fields) or "ничего"}')
+        self.fields = fields
+        self.sample_seconds = sample_seconds
+        self.window_samples = round(window_seconds / sample_seconds)
+        if self.window_samples < 1:
+            raise ValueError('Окно должно быть не короче отсчета')
+        self.samples = 0
+        self.totals = [0.0] * len(self.sampled)
+        self._windows = tuple(array('d') for _ in self.sampled)
+        self._partial = [0.0] * len(self.sampled)
+
+    def extend(self, *channels: Sequence[float]) -> None:
+        """Добавить отсчеты: по столбцу на каждое поле `SAMPLED_FIELDS`."""
+        if len(channels) != len(self.sampled):
+            raise TypeError(f'Ожидалось {len(self.sampled)} столбцов '
+                            f'({", ".join(self.sampled)}), получено '
+                            f'{len(channels)}')
+        count = len(channels[0])
+        if any(len(channel) != count for channel in channels):
+            raise ValueError('Столбцы отсчетов должны быть одной длины')
+        if not count:
+            return
+        filled = self.samples % self.window_samples
+        # Номера последних отсчетов порции в каждом закрытом окне.
+        ends = range(self.window_samples - filled - 1, count,
+                     self.window_samples)
+        np = _numpy()
+        for index, channel in enumerate(channels):
+            if np is not None:
+                sums = np.cumsum(np.asarray(channel, dtype=np.float64))
+                closed = sums[np.asarray(ends, dtype=np.intp)].tolist()
+                total = sums[-1].item()
+            else:
+                sums = list(accumulate(channel, initial=0.0))[1:]
+                closed = [sums[end] for end in ends]
+                total = sums[-1]
+            previous = [-self._partial[index]] + closed[:-1]
+            self._windows[index].extend(
+                end - start for start, end in zip(previous, closed))
+            self._partial[index] = total - (closed[-1] if closed else
+                                            -self._partial[index])
+            self.totals[index] += total
+        self.samples += count
+
+    @property
+    def duration(self) -> float:
+        """Длительность сессии в часах."""
+        return self.samples * self.sample_seconds / SECONDS_IN_HOUR
+
+    def package(self) -> list[float]:
+        """Данные сессии в формате пакета `read_package`."""
+        values = dict(zip(self.sampled, self.totals), **self.fields,
+                      duration=self.duration)
+        return [values[field] for field in self.decoder.fields]
+
+    def training(self) -> Training:
+        """Тренировка по итогам всех полученных отсчетов."""
+        return self.decoder.decode(self.package())
+
+    def show_training_info(self) -> InfoMessage:
+        """Информационное сообщение по итогам сессии."""
+        return self.training().show_training_info()
+
+    def windows(self, start: int = 0, partial: bool = False):
+        """Дистанция, скорость и калории по окнам начиная с `start`.
+
+        Считаются только закрытые окна; с `partial=True` добавляется
+        незаконченное окно со своей длительностью. Столбцы возвращаются
+        в формате `calculate_batch`.
+        """
+        sums = [list(window[start:]) for window in self._windows]
+        durations = [self.window_samples * self.sample_seconds
+                     / SECONDS_IN_HOUR] * len(sums[0])
+        remainder = self.samples % self.window_samples
+        if partial and remainder:
+            for column, value in zip(sums, self._partial):
+                column.append(value)
+            durations.append(remainder * self.sample_seconds
+                             / SECONDS_IN_HOUR)
+        values = dict(zip(self.sampled, sums), duration=durations)
+        values.update((field, [value] * len(durations))
+                      for field, value in self.fields.items())
+        return calculate_batch([self.workout_type] * len(durations),
+                               *(values[field]
+                                 for field in self.decoder.fields))
+
+
+class SamplingProfiler:
+    """Статистический профилировщик обработки пакетов.
+
+    Фоновый поток раз в `interval` секунд снимает стек потока
+    `thread_id` (по умолчанию - запустившего профилировщик) через
+    `sys._current_frames`; обрабатываемый код не инструментируется,
+    поэтому накладные расходы задаются только частотой выборок. Каждая
+    выборка относится к виду тренировки по ближайшему кадру модуля, в
+    котором видны `self`/`cls` тренировки, `InfoMessage` или код
+    `workout_type`; прочие попадают в вид `other`.
+    """
+
+    OTHER = 'other'
+
+    def __init__(self, interval: float = 0.005,
+                 thread_id: Optional[int] = None) -> None:
+        from collections import Counter
+
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = 0
+        self.dropped = 0
+        self.stacks: Counter = Counter()
+        self._stop = None
+        self._thread = None
+
+    def start(self) -> 'SamplingProfiler':
+        """Запустить поток выборок."""
+        import threading
+
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='homework-profiler')
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Остановить поток выборок."""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                # Кадр меняется во время выборки: пропускаем ее, а не
+                # останавливаем профилировщик.
+                self.dropped += 1
+
+    def sample(self) -> None:
+        """Снять одну выборку стека профилируемого потока."""
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        workout = None
+        while frame is not None:
+            code = frame.f_code
+            if workout is None and code.co_filename == __file__:
+                workout = self._workout(frame.f_locals)
+            names.append(f'{getattr(code, "co_qualname", code.co_name)} '
+                         f'({os.path.basename(code.co_filename)}:'
+                         f'{code.co_firstlineno})')
+            frame = frame.f_back
+        if names:
+            self.samples += 1
+            self.stacks[workout or self.OTHER, tuple(reversed(names))] += 1
+
+    @staticmethod
+    def _workout(local: dict) -> Optional[str]:
+        """Вид тренировки по локальным переменным кадра."""
+        owner = local.get('self', local.get('cls'))
+        if isinstance(owner, Training):
+            return type(owner).__name__
+        if isinstance(owner, type) and issubclass(owner, Training):
+            return owner.__name__
+        if isinstance(owner, InfoMessage):
+            # Выборка могла попасть внутрь `__init__`.
+            return getattr(owner, 'training_type', None)
+        workout_type = local.get('workout_type')
+        if isinstance(workout_type, str):
+            training_class = WORKOUT_CLASSES.get(workout_type)
+            return training_class.__name__ if training_class else None
+        return None
+
+    def workouts(self) -> list[str]:
+        """Виды тренировок, попавшие в выборки."""
+        return sorted({workout for workout, _ in self.stacks})
+
+    def collapsed(self, workout: Optional[str] = None) -> list[str]:
+        """Строки формата collapsed stacks для flamegraph.pl и speedscope.
+
+        Без `workout` в файл попадают все выборки, а вид тренировки
+        становится корневым кадром.
+        """
+        lines = []
+        for (label, stack), count in sorted(self.stacks.items()):
+            if workout is None:
+                stack = (label,) + stack
+            elif label != workout:
+                continue
+            lines.append(f'{";".join(stack)} {count}')
+        return lines
+
+    def top(self, count: int = 10) -> list[tuple[str, int, int]]:
+        """Самые горячие функции: имя, собственные и общие выборки."""
+        from collections import Counter
+
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for (_, stack), samples in self.stacks.items():
+            own[stack[-1]] += samples
+            for name in set(stack):
+                total[name] += samples
+        return [(name, samples, total[name])
+                for name, samples in own.most_common(count)]
+
+    def report(self, count: int = 10) -> str:
+        """Текстовая сводка: выборки по видам и горячие функции."""
+        from collections import Counter
+
+        by_workout: Counter = Counter()
+        for (workout, _), samples in self.stacks.items():
+            by_workout[workout] += samples
+        total = self.samples or 1
+        lines = [f'Выборок: {self.samples}, интервал '
+                 f'{self.interval * 1000:g} мс']
+        lines += [f'{samples / total:7.1%}  {workout}'
+                  for workout, samples in by_workout.most_common()]
+        lines.append(f'{"своё":>7}  {"всего":>7}  функция')
+        lines += [f'{own / total:7.1%}  {inclusive / total:7.1%}  {name}'
+                  for name, own, inclusive in self.top(count)]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: str) -> list[str]:
+        """Записать `all.collapsed` и по файлу на вид тренировки."""
+        os.makedirs(directory, exist_ok=True)
+        files = {'all': self.collapsed()}
+        files.update((workout, self.collapsed(workout))
+                     for workout in self.workouts())
+        paths = []
+        for name, lines in files.items():
+            path = os.path.join(directory, f'{name}.collapsed')
+            with open(path, 'w') as file:
+                file.writelines(f'{line}\n' for line in lines)
+            paths.append(path)
+        return paths
+
+
+def profiling(directory: str, interval: float = 0.005, top: int = 10):
+    """Профилировать блок кода и записать отчеты в `directory`.
+
+    Контекстный менеджер; сводка горячих функций печатается в stderr.
+    """
+    from contextlib import contextmanager
+
+    @contextmanager
+    def profiled():
+        profiler = SamplingProfiler(interval).start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            profiler.write(directory)
+            sys.stderr.write(profiler.report(top))
+    return profiled()
+
+
+def main(training: Training) -> None:
+    """Главная функция."""
+
+    info = training.show_training_info()
+    print(info.get_message())
+
+
+DEMO_PACKAGES = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+]
+
+
+def demo() -> None:
+    """Обработать встроенные примеры пакетов."""
+    for workout_type, data in DEMO_PACKAGES:
+        training = read_package(workout_type, data)
+        main(training)
+
+
+def cli(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа `python -m homework`.
+
+    Без аргументов печатает примеры, не загружая ничего лишнего;
+    подкоманды импортируют свои подсистемы только при вызове.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    directory = os.environ.get('HOMEWORK_PROFILE')
+    interval, top = _profile_interval(), 10
+    if not argv:
+        command = demo
+    else:
+        from functools import partial
+
+        args = _parse_args(argv)
+        directory = args.profile or directory
+        interval, top = args.profile_interval / 1000, args.profile_top
+        command = partial(_run_command, args)
+    if directory:
+        with profiling(directory, interval, top):
+            command()
+    else:
+        command()
+    return 0
+
+
+def _profile_interval() -> float:
+    """Интервал выборок из `HOMEWORK_PROFILE_INTERVAL` (мс) в секундах."""
+    return float(os.environ.get('HOMEWORK_PROFILE_INTERVAL', 5)) / 1000
+
+
+def _run_command(args) -> None:
+    """Выполнить разобранную подкоманду."""
+    if args.plugins:
+        load_workout_plugins()
+    if args.metrics:
+        enable_metrics()
+    args.command(args)
+    if args.metrics:
+        sys.stderr.write(METRICS.to_prometheus())
+
+
+def _parse_args(argv: Sequence[str]):
+    """Разобрать аргументы командной строки."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='homework', description='Модуль фитнес-трекера.')
+    parser.add_argument('--metrics', action='store_true',
+                        help='напечатать показатели в stderr по окончании')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='профилировать выборками и записать collapsed '
+                             'stacks в DIR (или HOMEWORK_PROFILE=DIR)')
+    parser.add_argument('--profile-interval', type=float,
+                        default=_profile_interval() * 1000, metavar='MS',
+                        help='интервал выборок профилировщика, мс')
+    parser.add_argument('--profile-top', type=int, default=10, metavar='N',
+                        help='число горячих функций в сводке')
+    parser.add_argument('--plugins', action='store_true',
+                        help='загрузить виды тренировок из entry points '
+                             f'{WORKOUT_ENTRY_POINTS}')
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser('demo', help='обработать примеры')
+    command.set_defaults(command=lambda args: demo())
+
+    command = commands.add_parser(
+        'stream', help='обработать построчный дамп пакетов')
+    command.add_argument('input', nargs='?', type=argparse.FileType('r'),
+                         default=sys.stdin)
+    command.add_argument('--chunk-size', type=int, default=1000)
+    command.add_argument('--flush-every', type=int, default=1)
+    command.add_argument('--skip-errors', action='store_true',
+                         help='пропускать испорченные строки, сообщая о '
+                              'них в stderr')
+    command.set_defaults(command=_run_stream)
+
+    command = commands.add_parser(
+        'parallel', help='обработать дамп пакетов в пуле процессов')
+    command.add_argument('input', nargs='?', type=argparse.FileType('r'),
+                         default=sys.stdin)
+    command.add_argument('--workers', type=int)
+    command.add_argument('--batch-size', type=int, default=1000)
+    command.add_argument('--unordered', action='store_true')
+    command.set_defaults(command=_run_parallel)
+
+    command = commands.add_parser(
+        'convert', help='перевести дамп пакетов в бинарный формат')
+    command.add_argument('input', type=argparse.FileType('r'))
+    command.add_argument('output')
+    command.set_defaults(command=lambda args: convert_packages(
+        args.input, args.output))
+
+    command = commands.add_parser(
+        'replay', help='обработать бинарный файл пакетов')
+    command.add_argument('input')
+    command.add_argument('--chunk-size', type=int, default=100_000)
+    command.set_defaults(command=_run_replay)
+
+    command = commands.add_parser(
+        'export', help='выгрузить результаты в CSV, Arrow или Parquet')
+    command.add_argument('input', type=argparse.FileType('r'))
+    command.add_argument('output')
+    command.add_argument('--format', choices=sorted(RESULT_WRITERS))
+    command.add_argument('--chunk-size', type=int, default=65536)
+    command.set_defaults(command=lambda args: export_results(
+        iter_packages(args.input), args.output, args.format,
+        args.chunk_size))
+
+    command = commands.add_parser('serve', help='запустить сервер пакетов')
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8765)
+    command.add_argument('--unix', help='путь Unix-сокета')
+    command.add_argument('--batch-size', type=int, default=1000)
+    command.add_argument('--stats-every', type=float, default=60,
+                         metavar='SECONDS',
+                         help='период записи показателей в stderr '
+                              '(0 - только по SIGUSR1 и при остановке)')
+    command.set_defaults(command=_run_server)
+    return parser.parse_args(argv)
+
+
+def _run_stream(args) -> None:
+    """Подкоманда `stream`."""
+    def report(line: str, error: Exception) -> None:
+        sys.stderr.write(f'ERROR: {line}: {type(error).__name__}: {error}\n')
+
+    process_stream(args.input, sys.stdout, args.chunk_size, args.flush_every,
+                   report if args.skip_errors else None)
+
+
+def _run_parallel(args) -> None:
+    """Подкоманда `parallel`."""
+    messages = process_parallel(iter_packages(args.input), args.workers,
+                                args.batch_size, not args.unordered)
+    for chunk in iter_chunks(messages, args.batch_size):
+        sys.stdout.write('\n'.join(chunk) + '\n')
+
+
+def _run_replay(args) -> None:
+    """Подкоманда `replay`."""
+    with PacketFile(args.input) as packets:
+        for start in range(0, len(packets), args.chunk_size):
+            stop = start + args.chunk_size
+            types = list(packets.types(start, stop))
+            durations = packets.columns(start, stop)[1].tolist()
+            names = [WORKOUT_CLASSES[code].__name__ for code in types]
+            results = (column.tolist()
+                       for column in packets.calculate(start, stop))
+            sys.stdout.write(render_columns(names, durations, *results))
+
+
+def _run_server(args) -> None:
+    """Подкоманда `serve`."""
+    import asyncio
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix,
+                          args.stats_every or None,
+                          batch_size=args.batch_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    # Плагины импортируют `homework`: это должен быть этот же модуль с
+    # его реестром видов тренировок, а не второй экземпляр, заново
+    # выполняющий весь файл.
+    sys.modules.setdefault('homework', sys.modules[__name__])
+    sys.exit(cli())
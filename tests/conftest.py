@@ -2,6 +2,8 @@ import sys
 from pathlib import Path
 from io import StringIO
 
+import pytest
+
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 sys.path.append(str(BASE_DIR))
 
@@ -29,3 +31,18 @@ class Capturing(list):
 
 def pytest_make_parametrize_id(config, val):
     return repr(val)
+
+
+@pytest.fixture(params=[True, False])
+def use_numpy(request, monkeypatch):
+    """Run the test with NumPy and with the pure Python fallback."""
+    import homework
+
+    monkeypatch.setattr(homework, 'USE_NUMPY', request.param)
+    return request.param
+
+
+def packet_lines(packages):
+    """Packets as stream lines like `RUN 15000 1 75`."""
+    return [f'{workout_type} ' + ' '.join(str(value) for value in data)
+            for workout_type, data in packages]
@@ -1,9 +1,19 @@
+import asyncio
+import csv
+import os
+import random
 import re
+import struct
+import subprocess
+import sys
+import time
+import tracemalloc
 import pytest
 import types
 import inspect
 from collections import namedtuple
-from conftest import Capturing
+from io import StringIO
+from conftest import BASE_DIR, Capturing, packet_lines
 
 try:
     import homework
@@ -451,3 +461,1085 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+BATCH_PACKAGES = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('RUN', [1206, 12, 6]),
+    ('WLK', [3000.33, 2.512, 75.8, 180.1]),
+    ('SWM', [1206, 12, 6, 12, 6]),
+    ('WLK', [420, 4, 20, 42]),
+]
+
+
+def test_calculate_batch(use_numpy):
+    types, columns = homework.package_columns(BATCH_PACKAGES)
+    distance, speed, calories = homework.calculate_batch(types, *columns)
+    for index, (workout_type, data) in enumerate(BATCH_PACKAGES):
+        training = homework.read_package(workout_type, data)
+        assert distance[index] == training.get_distance(), (
+            '`calculate_batch` должна считать дистанцию так же, '
+            'как `get_distance`.'
+        )
+        assert speed[index] == training.get_mean_speed(), (
+            '`calculate_batch` должна считать скорость так же, '
+            'как `get_mean_speed`.'
+        )
+        assert calories[index] == training.get_spent_calories(), (
+            '`calculate_batch` должна считать калории так же, '
+            'как `get_spent_calories`.'
+        )
+
+
+def test_calculate_batch_unknown_type(use_numpy):
+    with pytest.raises(KeyError):
+        homework.calculate_batch(['RUN', 'BOX'], [1, 1], [1, 1], [1, 1])
+
+
+@pytest.mark.parametrize('chunk_size, flush_every', [(1, 1), (2, 3), (100, 1)])
+def test_process_stream(chunk_size, flush_every):
+    lines = ['# заголовок дампа', '']
+    lines += packet_lines(BATCH_PACKAGES)
+    output = StringIO()
+    processed = homework.process_stream(
+        lines, output, chunk_size=chunk_size, flush_every=flush_every)
+    expected = [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in BATCH_PACKAGES
+    ]
+    assert processed == len(BATCH_PACKAGES), (
+        '`process_stream` должна вернуть число обработанных пакетов.'
+    )
+    assert output.getvalue().splitlines() == expected, (
+        '`process_stream` должна печатать те же сообщения, что и `main`.'
+    )
+
+
+class CountingOutput(StringIO):
+    """Поток, запоминающий, сколько раз его сбрасывали."""
+
+    flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_process_stream_errors(use_numpy):
+    good = packet_lines(BATCH_PACKAGES)
+    bad = ['RUN abc', 'RUN 15000 0 75', 'BOX 1 1 1']
+    lines = good[:3] + bad + good[3:]
+    expected = [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in BATCH_PACKAGES
+    ]
+    errors = []
+    output = CountingOutput()
+    processed = homework.process_stream(
+        lines, output, chunk_size=2, flush_every=3,
+        on_error=lambda line, error: errors.append((line, type(error))))
+    assert processed == len(BATCH_PACKAGES)
+    assert output.getvalue().splitlines() == expected
+    assert errors == [('RUN abc', ValueError),
+                      ('RUN 15000 0 75', ZeroDivisionError),
+                      ('BOX 1 1 1', homework.UnknownWorkoutError)], (
+        '`on_error` должен получать испорченную строку и ошибку.'
+    )
+    output = CountingOutput()
+    with pytest.raises(ValueError):
+        homework.process_stream(lines, output, chunk_size=1, flush_every=5)
+    assert output.getvalue().splitlines() == expected[:3], (
+        'Готовые сообщения должны быть записаны до выброса ошибки.'
+    )
+    assert output.flushes == 1
+
+
+def test_InfoMessage_slots():
+    info_message = homework.InfoMessage('Running', 1, 2, 3, 4)
+    assert not hasattr(info_message, '__dict__'), (
+        '`InfoMessage` должен хранить поля в `__slots__`.'
+    )
+
+
+def test_TrainingBatch():
+    batch = homework.TrainingBatch(BATCH_PACKAGES)
+    assert len(batch) == len(BATCH_PACKAGES)
+    distance, speed, calories = batch.calculate()
+    for index, (view, package) in enumerate(zip(batch, BATCH_PACKAGES)):
+        training = homework.read_package(*package)
+        assert view.duration == training.duration
+        assert view.get_distance() == training.get_distance() == (
+            distance[index])
+        assert view.get_mean_speed() == training.get_mean_speed() == (
+            speed[index])
+        assert view.get_spent_calories() == (
+            training.get_spent_calories()) == calories[index]
+        assert (view.show_training_info().get_message()
+                == training.show_training_info().get_message()), (
+            'Записи `TrainingBatch` должны давать те же сообщения, '
+            'что и объекты `Training`.'
+        )
+    with pytest.raises(TypeError):
+        batch.append('RUN', [1, 2])
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_process_parallel(ordered):
+    packages = BATCH_PACKAGES * 5
+    result = list(homework.process_parallel(
+        packages, workers=2, batch_size=3, ordered=ordered))
+    expected = [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in packages
+    ]
+    if not ordered:
+        result, expected = sorted(result), sorted(expected)
+    assert result == expected, (
+        '`process_parallel` должна возвращать те же сообщения, '
+        'что и последовательная обработка.'
+    )
+
+
+def test_packet_file(tmp_path, use_numpy):
+    path = str(tmp_path / 'packets.bin')
+    assert homework.write_packets(path, BATCH_PACKAGES) == len(
+        BATCH_PACKAGES)
+    with homework.PacketFile(path) as packets:
+        assert len(packets) == len(BATCH_PACKAGES)
+        assert list(packets.types()) == [
+            workout_type for workout_type, _ in BATCH_PACKAGES]
+        distance, speed, calories = packets.calculate()
+        assert list(packets.calculate(2, 4)[2]) == list(calories[2:4])
+    for index, package in enumerate(BATCH_PACKAGES):
+        training = homework.read_package(*package)
+        assert (distance[index], speed[index], calories[index]) == (
+            training.get_distance(),
+            training.get_mean_speed(),
+            training.get_spent_calories(),
+        ), '`PacketFile.calculate` должен совпадать с расчетом `Training`.'
+
+
+def test_packet_file_bad_header(tmp_path):
+    path = tmp_path / 'packets.bin'
+    path.write_bytes(b'not a packet file')
+    with pytest.raises(ValueError):
+        homework.PacketFile(str(path))
+
+
+@pytest.mark.parametrize('unix_socket', [False, True])
+def test_PacketServer(tmp_path, unix_socket):
+    lines = packet_lines(BATCH_PACKAGES)
+    lines.insert(2, 'BOX 1 1 1')
+    expected = [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in BATCH_PACKAGES
+    ]
+
+    async def scenario():
+        async with homework.PacketServer(batch_size=4, max_pending=3,
+                                         max_replies=2) as server:
+            if unix_socket:
+                path = str(tmp_path / 'packets.sock')
+                await server.start(path=path)
+                address = {'path': path}
+            else:
+                await server.start()
+                address = {'port': server.address[1]}
+            replies = await asyncio.gather(*(
+                homework.request_packets(lines, **address)
+                for _ in range(3)))
+            return replies, server.stats.snapshot()
+
+    replies, stats = asyncio.run(scenario())
+    for reply in replies:
+        assert reply[2].startswith('ERROR: UnknownWorkoutError'), (
+            'Сервер должен отвечать ошибкой на неизвестный вид тренировки.'
+        )
+        assert reply[:2] + reply[3:] == expected, (
+            'Сервер должен отвечать сообщениями в порядке пакетов.'
+        )
+    assert stats['processed'] == 3 * len(lines)
+    assert stats['errors'] == 3
+    assert stats['p50'] <= stats['p99']
+
+
+def test_PacketServer_close_answers_pending():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        errors = []
+        loop.set_exception_handler(lambda loop, context: errors.append(
+            context))
+        server = homework.PacketServer(batch_delay=60, max_pending=2)
+        await server.start()
+        reader, writer = await asyncio.open_connection(
+            port=server.address[1])
+        writer.write(b'RUN 15000 1 75\n' * 10)
+        await writer.drain()
+        await asyncio.sleep(0.05)
+        await server.close()
+        replies = [await reader.readline() for _ in range(10)]
+        writer.close()
+        await writer.wait_closed()
+        return replies, errors
+
+    replies, errors = asyncio.run(scenario())
+    answered = [reply for reply in replies if reply]
+    assert answered and all(
+        reply.startswith(b'ERROR: ConnectionAbortedError')
+        for reply in answered), (
+        'Пакеты, не рассчитанные до остановки сервера, получают ERROR.'
+    )
+    assert not errors, 'Остановка сервера не должна оставлять ошибок задач.'
+
+
+def test_render_messages():
+    values = [0, 1, 0.0005, 0.0015, 2.5, -3.2, 1e9, 123.4565, 7.9995]
+    messages = [
+        homework.InfoMessage(name, *(values[(index + shift) % len(values)]
+                                     for shift in range(4)))
+        for index, name in enumerate(['Running', 'Swimming', 'SportsWalking']
+                                     * 3)
+    ]
+    expected = [message.get_message() for message in messages]
+    rendered = ''.join(homework.render_messages(messages, chunk_size=4))
+    assert rendered == ''.join(line + '\n' for line in expected), (
+        '`render_messages` должна печатать тот же текст, что и '
+        '`get_message`.'
+    )
+    columns = list(zip(*(
+        (message.training_type, message.duration, message.distance,
+         message.speed, message.calories) for message in messages)))
+    assert homework.format_columns(*columns) == expected
+
+
+def test_show_training_info_computes_distance_once(monkeypatch):
+    reads = []
+    monkeypatch.setattr(homework.Running, 'LEN_STEP', property(
+        lambda self: reads.append(1) or 0.65))
+    training = homework.Running(15000, 1, 75)
+    training.show_training_info()
+    assert len(reads) == 1, (
+        '`show_training_info` должен считать дистанцию один раз.'
+    )
+    training.get_spent_calories()
+    training.get_spent_calories()
+    assert len(reads) == 3, (
+        'Вне `show_training_info` методы должны пересчитываться.'
+    )
+
+
+def test_ResultCache():
+    now = [0.0]
+    cache = homework.ResultCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    package = BATCH_PACKAGES[0]
+    expected = homework.read_package(*package).show_training_info()
+    for _ in range(2):
+        info = cache.show_training_info(*package)
+        assert info.get_message() == expected.get_message()
+    assert cache.stats() == {
+        'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+    now[0] = 11
+    cache.show_training_info(*package)
+    assert cache.misses == 2, 'Устаревшие записи должны пересчитываться.'
+    messages = cache.calculate_messages(BATCH_PACKAGES[:3] * 2)
+    assert messages == homework.calculate_messages(BATCH_PACKAGES[:3] * 2)
+    assert len(cache) == 2
+    assert cache.evictions > 0, 'Кэш должен вытеснять записи сверх `maxsize`.'
+
+
+def test_metrics():
+    metrics = homework.enable_metrics()
+    try:
+        for package in BATCH_PACKAGES:
+            homework.main(homework.read_package(*package))
+        with pytest.raises(KeyError):
+            homework.read_package('BOX', [1, 1, 1])
+        with pytest.raises(TypeError):
+            homework.read_package('RUN', [1, 1])
+    finally:
+        homework.disable_metrics()
+    homework.read_package(*BATCH_PACKAGES[0])
+    snapshot = metrics.to_dict()
+    assert set(snapshot['stages']) == {
+        'dispatch', 'construct', 'calculate', 'format'}
+    assert snapshot['stages']['dispatch']['RUN']['calls'] == 3
+    assert snapshot['stages']['calculate']['Running']['calls'] == 2
+    assert snapshot['stages']['format']['SportsWalking']['calls'] == 3
+    assert snapshot['errors'] == {
+        'dispatch': {'BOX': {'UnknownWorkoutError': 1}},
+        'construct': {'Running': {'PacketArityError': 1}},
+    }
+    text = metrics.to_prometheus()
+    assert ('homework_stage_calls_total{stage="format",'
+            'workout="Swimming"} 2') in text
+    assert ('homework_errors_total{stage="dispatch",workout="BOX",'
+            'error="UnknownWorkoutError"} 1') in text
+
+
+def test_metrics_batch_paths(monkeypatch, capsys, use_numpy):
+    lines = packet_lines(BATCH_PACKAGES)
+    monkeypatch.setattr(sys, 'stdin', StringIO('\n'.join(lines)))
+    try:
+        assert homework.cli(['--metrics', 'stream', '--chunk-size', '4']) == 0
+        stages = homework.METRICS.to_dict()['stages']
+    finally:
+        homework.disable_metrics()
+    assert stages['dispatch']['batch']['calls'] == 2, (
+        'Проверка пакетов учитывается одним вызовом на пачку.'
+    )
+    assert stages['dispatch']['batch']['rows'] == len(BATCH_PACKAGES)
+    assert stages['calculate']['SportsWalking']['rows'] == 3, (
+        'Расчет пачки учитывается по видам тренировок с числом пакетов.'
+    )
+    assert stages['format']['batch']['rows'] == len(BATCH_PACKAGES)
+    assert ('homework_stage_rows_total{stage="calculate",'
+            'workout="Swimming"} 2') in capsys.readouterr().err, (
+        '`--metrics stream` должен печатать показатели пакетного пути.'
+    )
+
+
+def test_WorkoutAggregator():
+    day = homework.SECONDS_IN_DAY
+    aggregator = homework.WorkoutAggregator(bucket=day, window=2 * day)
+    running = homework.Running(15000, 1, 75)
+    walking = homework.SportsWalking(9000, 1, 75, 180)
+    for timestamp in (0, 10, day + 5):
+        assert aggregator.add('ann', timestamp, running)
+    aggregator.add('ann', day + 6, walking)
+    aggregator.add('bob', 0, running)
+    summary = {info.training_type: info
+               for info in aggregator.summary('ann')}
+    info = running.show_training_info()
+    assert summary['Running'].distance == 3 * info.distance
+    assert summary['Running'].speed == info.speed
+    assert summary['SportsWalking'].duration == 1
+    assert [start for start, _ in aggregator.rollups('ann')] == [
+        0, day, day]
+    aggregator.add('ann', 3 * day, running)
+    assert [start for start, _ in aggregator.rollups('ann')] == [
+        day, day, 3 * day], 'Корзины старше окна должны удаляться.'
+    assert not aggregator.add('ann', 1, running), (
+        'Тренировки старше окна не должны учитываться.'
+    )
+    aggregator.expire(10 * day)
+    assert aggregator.summary('ann') == aggregator.summary('bob') == []
+
+
+def test_WorkoutAggregator_late_trainings():
+    day = homework.SECONDS_IN_DAY
+    aggregator = homework.WorkoutAggregator(bucket=day, window=4 * day)
+    running = homework.Running(15000, 1, 75)
+    for timestamp in (2 * day, 3 * day, day, 0):
+        assert aggregator.add('ann', timestamp, running)
+    assert [start for start, _ in aggregator.rollups('ann')] == [
+        0, day, 2 * day, 3 * day], (
+        'Корзины опоздавших тренировок должны вставать по времени начала.'
+    )
+    aggregator.add('ann', 5 * day, running)
+    assert [start for start, _ in aggregator.rollups('ann')] == [
+        day, 2 * day, 3 * day, 5 * day], (
+        'Устаревшие корзины должны сниматься с начала.'
+    )
+
+
+@pytest.mark.parametrize('input_data, error', [
+    (('BOX', [1, 1, 1]), homework.UnknownWorkoutError),
+    (('RUN', [1, 1]), homework.PacketArityError),
+    (('SWM', [720, 1, 80, 25]), homework.PacketArityError),
+    (('WLK', [9000, 1, 'heavy', 180]), homework.PacketError),
+    (('RUN', [15000, float('nan'), 75]), homework.PacketError),
+])
+def test_read_package_errors(input_data, error):
+    with pytest.raises(error):
+        homework.read_package(*input_data)
+
+
+def test_read_package_errors_compatible():
+    with pytest.raises(KeyError):
+        homework.read_package('BOX', [1, 1, 1])
+    with pytest.raises(TypeError):
+        homework.read_package('RUN', [1, 1])
+
+
+def test_read_packages():
+    groups = homework.read_packages(BATCH_PACKAGES)
+    assert list(groups) == ['SWM', 'RUN', 'WLK'], (
+        'Группы должны идти в порядке первого появления кода.'
+    )
+    for workout_type, trainings in groups.items():
+        expected = [data for code, data in BATCH_PACKAGES
+                    if code == workout_type]
+        assert [training.action for training in trainings] == [
+            data[0] for data in expected]
+        assert all(type(training) is homework.WORKOUT_CLASSES[workout_type]
+                   for training in trainings)
+
+
+def test_precompiled_formats():
+    assert homework._compile_message(homework.InfoMessage.MESSAGE_TRANING) == (
+        homework.MESSAGE_FORMAT, homework.MESSAGE_FIELDS), (
+        '`MESSAGE_FORMAT` должен совпадать с разобранным шаблоном сообщения.'
+    )
+    assert struct.calcsize(homework.PACKET_HEADER_FORMAT) == (
+        homework.PACKET_HEADER_SIZE)
+    assert struct.calcsize(homework.PACKET_RECORD_FORMAT) == (
+        homework.PACKET_RECORD_SIZE)
+
+
+def test_import_is_lightweight():
+    heavy = ['argparse', 'array', 'asyncio', 'collections',
+             'concurrent.futures', 'contextlib', 'functools', 'hashlib',
+             'mmap', 'numpy', 'operator', 're', 'sqlite3', 'string',
+             'struct', 'typing']
+    code = (
+        'import sys, homework; homework.cli([]); '
+        f'print([name for name in {heavy!r} if name in sys.modules])'
+    )
+    result = subprocess.run([sys.executable, '-c', code],
+                            cwd=BASE_DIR, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.splitlines()[-1] == '[]', (
+        'Импорт `homework` и запуск примеров не должны загружать '
+        'тяжелые подсистемы.'
+    )
+
+
+def test_cli_stream(monkeypatch, capsys):
+    lines = packet_lines(BATCH_PACKAGES)
+    monkeypatch.setattr(sys, 'stdin', StringIO('\n'.join(lines)))
+    assert homework.cli(['stream', '--chunk-size', '2']) == 0
+    expected = [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in BATCH_PACKAGES
+    ]
+    assert capsys.readouterr().out.splitlines() == expected
+
+
+def test_cli_stream_skip_errors(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'stdin', StringIO('RUN 15000 1 75\nRUN abc\n'))
+    assert homework.cli(['stream', '--skip-errors']) == 0
+    captured = capsys.readouterr()
+    assert captured.out == homework.read_package(
+        'RUN', [15000, 1, 75]).show_training_info().get_message() + '\n'
+    assert captured.err.startswith('ERROR: RUN abc: ValueError'), (
+        'С `--skip-errors` испорченная строка уходит в stderr.'
+    )
+
+
+def expected_results(packages):
+    infos = [homework.read_package(*package).show_training_info()
+             for package in packages]
+    return [(info.training_type, info.duration, info.distance, info.speed,
+             info.calories) for info in infos]
+
+
+def test_export_results_csv(tmp_path):
+    path = str(tmp_path / 'results.csv')
+    count = homework.export_results(BATCH_PACKAGES, path, chunk_size=3)
+    assert count == len(BATCH_PACKAGES)
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+    assert tuple(rows[0]) == homework.EXPORT_COLUMNS
+    assert [(row[0], *map(float, row[1:])) for row in rows[1:]] == (
+        expected_results(BATCH_PACKAGES)), (
+        'CSV должен хранить результаты без потери точности.'
+    )
+
+
+@pytest.mark.parametrize('format', ['arrow', 'parquet'])
+def test_export_results_arrow(tmp_path, format):
+    pyarrow = pytest.importorskip('pyarrow')
+    path = str(tmp_path / f'results.{format}')
+    homework.export_results(BATCH_PACKAGES, path, chunk_size=3)
+    if format == 'arrow':
+        table = pyarrow.ipc.open_file(path).read_all()
+    else:
+        table = pytest.importorskip('pyarrow.parquet').read_table(path)
+    assert table.column_names == list(homework.EXPORT_COLUMNS)
+    assert list(zip(*table.to_pydict().values())) == expected_results(
+        BATCH_PACKAGES)
+
+
+def test_process_shared(use_numpy):
+    packages = BATCH_PACKAGES * 3
+    with homework.process_shared(packages, workers=2,
+                                 batch_size=4) as results:
+        distance, speed, calories = results.columns()
+        assert list(zip(distance, speed, calories)) == [
+            row[2:] for row in expected_results(packages)], (
+            'Воркеры должны записать результаты в строки своих пакетов.'
+        )
+        text = ''.join(results.render(packages, chunk_size=5))
+        del distance, speed, calories
+    assert text.splitlines() == homework.calculate_messages(packages)
+
+
+def test_kernels_match_methods():
+    for package in BATCH_PACKAGES:
+        training = homework.read_package(*package)
+        assert type(training).calculate(*package[1]) == (
+            training.get_distance(),
+            training.get_mean_speed(),
+            training.get_spent_calories(),
+        ), 'Ядра формул должны давать те же значения, что и методы.'
+
+
+@pytest.mark.parametrize('backend', ['python', 'numba'])
+def test_calculate_batch_backends(monkeypatch, backend):
+    pytest.importorskip('numpy')
+    if backend == 'numba':
+        pytest.importorskip('numba')
+    monkeypatch.setattr(homework, 'KERNEL_BACKEND', backend)
+    packages = BATCH_PACKAGES * 10
+    types, columns = homework.package_columns(packages)
+    result = homework.calculate_batch(types, *columns)
+    assert list(zip(*result)) == [row[2:] for row in expected_results(
+        packages)], f'Ядра {backend} должны совпадать с расчетом объектов.'
+
+
+def test_PacketDeduplicator():
+    deduplicator = homework.PacketDeduplicator(
+        capacity=100, error_rate=0.01, exact_size=5)
+    records = [(device, *package) for device in ('watch-1', 'watch-2')
+               for package in BATCH_PACKAGES]
+    resent = records[3:] + records[:3] + [
+        ('watch-1', 'RUN', [15000.0, 1.0, 75.0])]
+    unique = list(deduplicator.filter(records + resent))
+    assert unique == records, (
+        'Повторы и переупорядоченные пакеты должны отбрасываться.'
+    )
+    stats = deduplicator.stats()
+    assert stats['seen'] == len(records) + len(resent)
+    assert stats['exact_duplicates'] + stats['probable_duplicates'] == len(
+        resent)
+    assert 0 < stats['false_positive_rate'] < 0.01
+
+
+def test_PacketDeduplicator_rotation():
+    deduplicator = homework.PacketDeduplicator(
+        capacity=50, error_rate=0.01, exact_size=1)
+    packages = [('watch', 'RUN', [index, 1, 75]) for index in range(200)]
+    assert len(list(deduplicator.filter(packages))) >= 190
+    assert deduplicator.is_duplicate(*packages[-1])
+    assert not deduplicator.is_duplicate(*packages[0]), (
+        'Пакеты старше двух поколений фильтра должны забываться.'
+    )
+
+
+ANOMALIES = [
+    (('RUN', [15000, 0, 75]), 'duration'),
+    (('RUN', [15000, 1, 0]), 'weight'),
+    (('RUN', [-5, 1, 75]), 'action'),
+    (('RUN', [150000, 1, 75]), 'speed'),
+    (('WLK', [9000, 1, 75, 0]), 'height'),
+    (('WLK', [90000, 1, 75, 180]), 'speed'),
+    (('SWM', [720, 1, 80, 25, 0]), 'pool'),
+    (('SWM', [72000, 1, 80, 25, 40]), 'strokes'),
+    (('SWM', [720, 1, 80, 0, 40]), 'pool'),
+    (('BOX', [1, 1, 1]), 'type'),
+    (('RUN', [1, 1]), 'arity'),
+    (('WLK', [9000, 1, 'heavy', 180]), 'value'),
+]
+
+
+@pytest.mark.parametrize('package, reason', ANOMALIES)
+def test_validate_package(package, reason):
+    assert homework.validate_package(*package) == reason
+
+
+def test_filter_packages(use_numpy):
+    clean = [('SWM', [720, 1, 80, 25, 40]), ('RUN', [15000, 1, 75]),
+             ('WLK', [9000, 1, 75, 180])]
+    packages = []
+    for index, (package, _) in enumerate(ANOMALIES):
+        packages += [clean[index % len(clean)], package]
+    rejects = []
+    passed = list(homework.filter_packages(
+        packages, lambda *reject: rejects.append(reject), chunk_size=5))
+    assert passed == [clean[index % len(clean)]
+                      for index in range(len(ANOMALIES))]
+    assert rejects == [(*package, reason) for package, reason in ANOMALIES], (
+        'Брак должен уходить в `on_reject` с кодом причины.'
+    )
+
+
+def test_calculate_packages_rejects(use_numpy):
+    clean = homework.DEMO_PACKAGES
+    packages = []
+    for index, (package, _) in enumerate(ANOMALIES):
+        packages += [clean[index % len(clean)], package]
+    rejects = []
+    messages = homework.calculate_messages(
+        packages, on_reject=lambda *reject: rejects.append(reject))
+    assert sorted(rejects, key=str) == sorted(
+        [(*package, reason) for package, reason in ANOMALIES], key=str), (
+        'Брак должен уходить в `on_reject` с кодом причины.'
+    )
+    assert messages == homework.calculate_messages(
+        list(homework.filter_packages(packages))), (
+        'Расчет с `on_reject` должен совпадать с расчетом после фильтра.'
+    )
+
+
+def realistic_packages(count, seed=0):
+    rng = random.Random(seed)
+    packages = []
+    for _ in range(count):
+        duration = round(rng.uniform(0.25, 2.5), 3)
+        weight = round(rng.uniform(45, 110), 1)
+        workout_type = rng.choice(['SWM', 'RUN', 'WLK'])
+        if workout_type == 'SWM':
+            data = [rng.randint(300, 4000), duration, weight,
+                    rng.choice([25, 50]), rng.randint(10, 120)]
+        elif workout_type == 'RUN':
+            data = [rng.randint(5000, 40000), duration, weight]
+        else:
+            data = [rng.randint(3000, 20000), duration, weight,
+                    rng.randint(150, 200)]
+        packages.append((workout_type, data))
+    return packages
+
+
+def test_fixed_precision_keeps_messages(use_numpy):
+    packages = realistic_packages(3000) + BATCH_PACKAGES
+    types, columns = homework.package_columns(packages)
+    fixed = homework.calculate_batch(types, *columns, precision='fixed')
+    results = [homework.dequantize(column, 'fixed') for column in fixed]
+    names = [homework.WORKOUT_CLASSES[code].__name__ for code in types]
+    expected = [homework.read_package(*package).show_training_info()
+                .get_message() for package in packages]
+    assert homework.format_columns(names, columns[1], *results) == expected, (
+        'Режим `fixed` не должен менять текст сообщений.'
+    )
+
+
+@pytest.mark.parametrize('value', [2147483.648, -3e6, float('inf'),
+                                   float('nan')])
+def test_fixed_precision_rejects_out_of_range(use_numpy, value):
+    assert homework.quantize([homework.FIXED_MAX], 'fixed')[0] == 2 ** 31 - 1
+    with pytest.raises(OverflowError):
+        homework.quantize([1.0, value], 'fixed')
+    with pytest.raises(ValueError):
+        homework.calculate_batch(['RUN'], [1], [1], [1],
+                                 precision='float32')
+
+
+def test_quantize_ties():
+    for value in (0.0005, 0.0015, 2.0005, 1234.5675, 0.1235, 797.8045):
+        expected = float(f'{value:.3f}') * 1000
+        assert homework.quantize([value], 'fixed')[0] == round(expected)
+
+
+class Cycling(homework.Training):
+    """Тренировка-плагин: велосипед."""
+
+    LEN_STEP = 5.5
+    CALORIES_CADENCE_MULTIPLIER = 0.1
+    FIELDS = ('action', 'duration', 'weight', 'cadence')
+
+    def __init__(self, action, duration, weight, cadence):
+        super().__init__(action, duration, weight)
+        self.cadence = cadence
+
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, cadence,
+                           kernels=None):
+        return (speed * weight * cls.CALORIES_CADENCE_MULTIPLIER
+                + cadence) * duration
+
+
+@pytest.fixture
+def cycling():
+    homework.register_workout('CYC')(Cycling)
+    yield Cycling
+    homework.unregister_workout('CYC')
+
+
+def test_register_workout_read_package(cycling):
+    training = homework.read_package('CYC', [3000, 1.5, 80, 90])
+    assert isinstance(training, Cycling)
+    message = training.show_training_info()
+    distance = 3000 * Cycling.LEN_STEP / 1000
+    assert message.calories == pytest.approx(
+        (distance / 1.5 * 80 * 0.1 + 90) * 1.5), (
+        'Базовый `get_spent_calories` должен передавать поля плагина '
+        'в `calculate_calories`.'
+    )
+    with pytest.raises(homework.PacketArityError, match='cadence'):
+        homework.read_package('CYC', [3000, 1.5, 80])
+
+
+def test_register_workout_batch(cycling, use_numpy):
+    packages = BATCH_PACKAGES + [('CYC', [3000, 1.5, 80, 90]),
+                                 ('CYC', [1200, 0.5, 65, 70])]
+    results = homework.calculate_results(packages)
+    assert list(zip(*results)) == pytest.approx(expected_results(packages)), (
+        'Плагин должен считаться пакетным расчетом так же, как объектами.'
+    )
+
+
+def test_register_workout_rejects():
+    with pytest.raises(ValueError, match='уже зарегистрирован'):
+        homework.register_workout('RUN', Cycling)
+    with pytest.raises(TypeError):
+        homework.register_workout('BAD', object)
+    with pytest.raises(ValueError, match='ASCII'):
+        homework.register_workout('CYCLE', Cycling)
+
+    class Wide(Cycling):
+        FIELDS = ('duration', 'action', 'weight')
+
+    with pytest.raises(ValueError, match='FIELDS'):
+        homework.register_workout('WID', Wide)
+    assert 'WID' not in homework.DECODERS
+
+
+def test_register_workout_checks_formulas():
+    class NoKernels(Cycling):
+        @classmethod
+        def calculate_calories(cls, speed, duration, weight, cadence):
+            return speed * duration
+
+    class NoCalories(homework.Training):
+        pass
+
+    class ScalarCalculate(Cycling):
+        @classmethod
+        def calculate(cls, action, duration, weight, cadence,
+                      kernels=None):
+            return max(action, 1.0), duration, weight
+
+    for training_class, match in ((NoKernels, 'kernels'),
+                                  (NoCalories, 'формулы калорий'),
+                                  (ScalarCalculate, 'массивы')):
+        with pytest.raises(TypeError, match=match):
+            homework.register_workout('BAD', training_class)
+    assert 'BAD' not in homework.WORKOUT_CLASSES
+
+
+class Hiking(Cycling):
+    """Плагин без векторной формулы: своя скорость и условие в калориях."""
+
+    def get_mean_speed(self):
+        return self.get_distance() / self.duration * 0.9
+
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, cadence,
+                           kernels=None):
+        if cadence > 80:
+            return speed * weight * duration
+        return speed * duration
+
+
+class BranchyCycling(Cycling):
+    """Плагин с условием в формуле калорий: массивы она не считает."""
+
+    @classmethod
+    def calculate_calories(cls, speed, duration, weight, cadence,
+                           kernels=None):
+        if cadence > 80:
+            return speed * weight * duration
+        return speed * duration
+
+
+@pytest.mark.parametrize('training_class', [Hiking, BranchyCycling])
+def test_register_workout_row_fallback(use_numpy, training_class):
+    homework.register_workout('HIK', training_class)
+    try:
+        packages = BATCH_PACKAGES + [('HIK', [3000, 1.5, 80, 90]),
+                                     ('HIK', [1200, 0.5, 65, 70])]
+        results = homework.calculate_results(packages)
+        assert list(zip(*results)) == pytest.approx(
+            expected_results(packages)), (
+            'Пакетный расчет плагина без векторной формулы должен '
+            'совпадать с `show_training_info`.'
+        )
+        with pytest.raises(ZeroDivisionError):
+            homework.calculate_results([('HIK', [3000, 0, 80, 90])])
+    finally:
+        homework.unregister_workout('HIK')
+
+
+def test_load_workout_plugins_keeps_builtins(monkeypatch):
+    entry_point = types.SimpleNamespace(
+        name='RUN', value='cycling_plugin:Cycling', load=lambda: Cycling)
+    monkeypatch.setattr('importlib.metadata.entry_points',
+                        lambda group: [entry_point])
+    with pytest.raises(ValueError, match='встроенный'):
+        homework.load_workout_plugins()
+    assert homework.WORKOUT_CLASSES['RUN'] is homework.Running
+
+
+def test_load_workout_plugins(monkeypatch):
+    entry_point = types.SimpleNamespace(name='CYC', load=lambda: Cycling)
+    monkeypatch.setattr('importlib.metadata.entry_points',
+                        lambda group: [entry_point])
+    try:
+        assert homework.load_workout_plugins() == ['CYC']
+        assert homework.DECODERS['CYC'].training_class is Cycling
+    finally:
+        homework.unregister_workout('CYC')
+
+
+def test_sample_session_matches_package(use_numpy):
+    rng = random.Random(1)
+    steps = [rng.randint(0, 4) for _ in range(3725)]
+    session = homework.SampleSession('WLK', weight=75, height=180)
+    for start in range(0, len(steps), 1000):
+        session.extend(steps[start:start + 1000])
+    assert session.package() == [sum(steps), 3725 / 3600, 75, 180]
+    expected = homework.read_package('WLK', session.package())
+    assert (session.show_training_info().get_message()
+            == expected.show_training_info().get_message())
+
+    distance, speed, calories = session.windows(partial=True)
+    assert len(distance) == 63, 'Ожидалось 62 полных окна и одно неполное.'
+    for index, start in enumerate(range(0, len(steps), 60)):
+        window = steps[start:start + 60]
+        training = homework.read_package(
+            'WLK', [sum(window), len(window) / 3600, 75, 180])
+        assert (distance[index], speed[index], calories[index]) == (
+            pytest.approx((training.get_distance(),
+                           training.get_mean_speed(),
+                           training.get_spent_calories())))
+    assert len(session.windows(start=60)[0]) == 2
+
+
+def test_sample_session_swimming():
+    session = homework.SampleSession('SWM', sample_seconds=2,
+                                     window_seconds=120, weight=80,
+                                     length_pool=25)
+    session.extend([1] * 1800, [0.05] * 1800)
+    message = session.show_training_info()
+    expected = homework.read_package('SWM', [1800, 1, 80, 25, 90])
+    assert message.get_message() == (
+        expected.show_training_info().get_message())
+    assert len(session.windows()[0]) == 30
+    with pytest.raises(TypeError, match='length_pool'):
+        homework.SampleSession('SWM', weight=80)
+    with pytest.raises(TypeError):
+        session.extend([1, 2])
+
+
+def test_result_store(tmp_path):
+    records = [(index % 3, 1000.0 * index, workout_type, data)
+               for index, (workout_type, data)
+               in enumerate(BATCH_PACKAGES * 3)]
+    path = str(tmp_path / 'results.sqlite')
+    with homework.ResultStore(path) as store:
+        assert store.add_packages(records, chunk_size=4) == len(records)
+    with homework.ResultStore(path) as store:
+        assert len(store) == len(records)
+        selected = [record for record in records
+                    if record[0] == 1 and record[2] == 'RUN'
+                    and 2000 <= record[1] < 15000]
+        batches = list(store.query('RUN', user_id=1, start=2000,
+                                   stop=15000, batch_size=1))
+        assert len(batches) == len(selected)
+        users, timestamps, types, *values = (
+            sum((list(batch[index]) for batch in batches), [])
+            for index in range(7))
+        assert timestamps == [record[1] for record in selected]
+        assert set(users) == {'1'} and set(types) == {'RUN'}
+        expected = expected_results([record[2:] for record in selected])
+        assert list(zip(*values)) == [row[1:] for row in expected]
+
+        messages = [homework.read_package(workout_type, data)
+                    .show_training_info().get_message()
+                    for _, _, workout_type, data in records]
+        assert list(store.messages()) == messages, (
+            'Сообщения из хранилища должны совпадать с `get_message`.'
+        )
+        plan = store.connection.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM results '
+            'WHERE workout_type = ? AND timestamp >= ?', ('RUN', 0)
+        ).fetchall()
+        assert 'results_type_time' in str(plan)
+
+
+def test_training_cursor_reuses_objects():
+    cursor = homework.TrainingCursor()
+    packages = realistic_packages(3000, seed=2)
+    messages = [cursor.get_message(*package) for package in packages]
+    assert messages == [
+        homework.read_package(*package).show_training_info().get_message()
+        for package in packages
+    ], 'Курсор должен давать те же сообщения, что и `read_package`.'
+    training = cursor.load('RUN', [9000, 1, 75])
+    info = cursor.show_training_info('RUN', [15000, 1, 75])
+    assert cursor.load('RUN', [15000, 1, 75]) is training
+    assert cursor.show_training_info('SWM', [720, 1, 80, 25, 40]) is info
+    with pytest.raises(homework.PacketArityError):
+        cursor.load('RUN', [9000, 1])
+
+
+def test_training_cursor_allocations():
+    cursor = homework.TrainingCursor()
+    packages = realistic_packages(20000, seed=3)
+    for package in packages[:1000]:
+        cursor.get_message(*package)
+    longest = max(sys.getsizeof(cursor.get_message(*package))
+                  for package in packages)
+    message = None
+    only_homework = [tracemalloc.Filter(True, homework.__file__)]
+    tracemalloc.start()
+    try:
+        start = tracemalloc.take_snapshot().filter_traces(only_homework)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        for package in packages:
+            message = cursor.get_message(*package)
+        peak = tracemalloc.get_traced_memory()[1]
+        end = tracemalloc.take_snapshot().filter_traces(only_homework)
+    finally:
+        tracemalloc.stop()
+    retained = end.compare_to(start, 'filename')
+    assert sum(stat.count_diff for stat in retained) == 1, (
+        'После обработки должна остаться только последняя строка.'
+    )
+    # Предыдущая и новая строки плюс временные float и кортежи,
+    # переиспользуемые интерпретатором между пакетами.
+    assert peak - before <= 2 * longest + 512, (
+        'На пакет не должно выделяться ничего, кроме строки сообщения.'
+    )
+    assert message
+
+
+def test_sampling_profiler(tmp_path):
+    packages = realistic_packages(500, seed=4)
+    deadline = time.monotonic() + 10
+    with homework.profiling(str(tmp_path), interval=0.001) as profiler:
+        while profiler.samples < 50 and time.monotonic() < deadline:
+            for package in packages:
+                homework.read_package(*package).show_training_info(
+                ).get_message()
+    assert profiler.samples >= 50, 'Поток выборок не должен останавливаться.'
+    assert set(profiler.workouts()) <= {'Swimming', 'Running',
+                                        'SportsWalking', 'other'}
+    assert {'Swimming', 'Running', 'SportsWalking'} & set(
+        profiler.workouts()), 'Выборки должны делиться по видам тренировок.'
+    lines = (tmp_path / 'all.collapsed').read_text().splitlines()
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == (
+        profiler.samples)
+    assert all(re.fullmatch(r'[^;]+(;[^;]+)+ \d+', line) for line in lines)
+    for workout in profiler.workouts():
+        assert (tmp_path / f'{workout}.collapsed').exists()
+    top = profiler.top(5)
+    assert top and all(own <= total for _, own, total in top)
+
+
+def test_cli_profile(monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv('HOMEWORK_PROFILE', str(tmp_path))
+    assert homework.cli([]) == 0
+    captured = capsys.readouterr()
+    assert 'Выборок:' in captured.err
+    assert (tmp_path / 'all.collapsed').exists()
+    monkeypatch.delenv('HOMEWORK_PROFILE')
+    directory = tmp_path / 'flag'
+    assert homework.cli(['--profile', str(directory),
+                         '--profile-interval', '1', 'demo']) == 0
+    assert (directory / 'all.collapsed').exists()
+
+
+def test_cli_plugins_entry_point(tmp_path):
+    (tmp_path / 'cycling_plugin.py').write_text(
+        'from homework import Training\n'
+        '\n'
+        '\n'
+        'class Cycling(Training):\n'
+        "    FIELDS = ('action', 'duration', 'weight', 'cadence')\n"
+        '\n'
+        '    def __init__(self, action, duration, weight, cadence):\n'
+        '        super().__init__(action, duration, weight)\n'
+        '        self.cadence = cadence\n'
+        '\n'
+        '    @classmethod\n'
+        '    def calculate_calories(cls, speed, duration, weight, cadence,\n'
+        '                           kernels=None):\n'
+        '        return (speed * weight + cadence) * duration\n'
+    )
+    dist_info = tmp_path / 'cycling_plugin-0.1.dist-info'
+    dist_info.mkdir()
+    (dist_info / 'METADATA').write_text(
+        'Metadata-Version: 2.1\nName: cycling-plugin\nVersion: 0.1\n')
+    (dist_info / 'entry_points.txt').write_text(
+        '[homework.workouts]\nCYC = cycling_plugin:Cycling\n')
+    for command in (['-m', 'homework'], [str(BASE_DIR / 'homework.py')]):
+        result = subprocess.run(
+            [sys.executable, *command, '--plugins', 'stream'],
+            input='CYC 3000 1.5 80 90\nRUN 15000 1 75\n', cwd=BASE_DIR,
+            env={'PYTHONPATH': f'{tmp_path}{os.pathsep}{BASE_DIR}'},
+            capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.startswith('Тип тренировки: Cycling;'), (
+            'Плагин из entry points должен работать при запуске модуля '
+            'как `__main__`.'
+        )
+
+
+@pytest.mark.parametrize('package, error', [
+    (('RUN', [15000, 1]), homework.PacketArityError),
+    (('RUN', [15000, 1, 75, 180]), homework.PacketArityError),
+    (('WLK', [9000, 1, 75, float('nan')]), homework.PacketError),
+    (('BOX', [1, 1, 1]), homework.UnknownWorkoutError),
+    (('RUN', [15000, 0, 75]), ZeroDivisionError),
+    (('WLK', [9000, 1, 75, 0]), ZeroDivisionError),
+])
+def test_calculate_results_checks_each_package(use_numpy, package, error):
+    with pytest.raises(error):
+        homework.read_package(*package).show_training_info()
+    for neighbours in ([], BATCH_PACKAGES):
+        with pytest.raises(error):
+            homework.calculate_results(neighbours + [package])
+    rejected = []
+    messages = homework.calculate_messages(
+        BATCH_PACKAGES[:1] + [package] + BATCH_PACKAGES[1:],
+        on_error=lambda row, exc: rejected.append((row, type(exc))))
+    assert rejected == [(1, error)], (
+        '`on_error` получает номер и ошибку испорченного пакета.'
+    )
+    assert messages == homework.calculate_messages(BATCH_PACKAGES), (
+        'Остальные пакеты пачки должны быть рассчитаны.'
+    )
+
+
+@pytest.mark.parametrize('batch_size', [1, 100])
+def test_serve_reports_stats_and_rejects_bad_packets(tmp_path, batch_size):
+    bad = ['RUN 15000 1', 'RUN 15000 1 75 180', 'RUN 15000 0 75',
+           'WLK 9000 1 75 nan']
+    lines = packet_lines(BATCH_PACKAGES)
+    mixed = [line for pair in zip(lines, bad + [''] * len(lines))
+             for line in pair if line]
+    path = str(tmp_path / 'packets.sock')
+    output = StringIO()
+
+    async def scenario():
+        task = asyncio.create_task(homework.serve(
+            path=path, report_every=0.05, output=output,
+            batch_size=batch_size))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if (tmp_path / 'packets.sock').exists():
+                break
+        replies = await homework.request_packets(mixed, path=path)
+        await asyncio.sleep(0.12)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return replies
+
+    replies = dict(zip(mixed, asyncio.run(scenario())))
+    for line in bad:
+        assert replies[line].startswith('ERROR: '), (
+            'Испорченный пакет должен получать ERROR при любых соседях '
+            'по пачке.'
+        )
+    for line, package in zip(lines, BATCH_PACKAGES):
+        assert replies[line] == homework.read_package(
+            *package).show_training_info().get_message()
+    reports = output.getvalue().splitlines()
+    assert len(reports) >= 2, 'Показатели пишутся периодически и в конце.'
+    assert re.fullmatch(
+        rf'processed={len(mixed)} errors={len(bad)} throughput=\S+/s '
+        r'p50=\S+ms p90=\S+ms p99=\S+ms', reports[-1])